@@ -1 +1,33 @@
-from .channels import DataLogger
\ No newline at end of file
+"""
+The names below are imported on first use, so that importing the package
+(or a single driver from the start script) stays cheap. The import times are
+kept in import_times and shown in the startup report of the DataLogger.
+"""
+import importlib
+import time
+
+_LAZY = dict(DataLogger='.channels',
+             CryoCon='.cryocon',
+             LakeShore331='.lakeshore331',
+             HeliumDepth='.helium_depth',
+             PressureGauge='.pressure_gauge',
+             OpticReader='.optic_reader',
+             RedpitayaChannel='.redpitaya_channel',
+             IonPumpPressure='.ion_pump_pressure')
+
+import_times = dict() # module -> import duration (s)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module %r has no attribute %r" % (__name__,
+                                                                 name))
+    start = time.perf_counter()
+    module = importlib.import_module(_LAZY[name], __name__)
+    import_times.setdefault(_LAZY[name], time.perf_counter() - start)
+    value = globals()[name] = getattr(module, name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
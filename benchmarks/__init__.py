@@ -0,0 +1,16 @@
+"""
+Benchmarks of the hot paths of the DataLogger:
+
+    - storage.write_throughput: Channel.plot_and_save_point
+    - storage.load_latency: Channel.load_data against .chan files of
+      increasing size
+    - plotting.plot_point_cost: MyTreeWidgetItem.plot_point and the refresh
+      of the curve, as the curve grows (needs Qt)
+    - acquisition.end_to_end: samples per second through Channel.measure,
+      with channels reading simulated instruments
+
+    python -m datalogger.benchmarks [names] [--output results.json]
+
+The results are written as JSON, with the versions of the code and the
+environment, to be compared between versions.
+"""
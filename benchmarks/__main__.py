@@ -0,0 +1,62 @@
+import argparse
+import json
+import sys
+from contextlib import redirect_stdout
+
+from .common import environment
+from . import storage, plotting, acquisition
+
+BENCHMARKS = dict(write_throughput=storage.write_throughput,
+                  load_latency=storage.load_latency,
+                  plot_point_cost=plotting.plot_point_cost,
+                  end_to_end=acquisition.end_to_end)
+
+UNITS = dict(kB=2**10, MB=2**20, GB=2**30)
+
+
+def parse_size(text):
+    for unit, factor in UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)])*factor)
+    return int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of the DataLogger, results in JSON')
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run among %s (default: all)' %
+                             ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--output', help='JSON file (default: stdout)')
+    parser.add_argument('--sizes', nargs='+', type=parse_size,
+                        default=[2**20, 10*2**20, 100*2**20],
+                        help='sizes of the files of load_latency, e.g. 10GB')
+    parser.add_argument('--channels', nargs='+', type=int,
+                        default=[1, 10, 50],
+                        help='numbers of channels of end_to_end')
+    parser.add_argument('--duration', type=float, default=5.,
+                        help='duration of each end_to_end run (s)')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %s' % name)
+    options = dict(load_latency=dict(sizes=args.sizes),
+                   end_to_end=dict(n_channels=args.channels,
+                                   duration=args.duration))
+
+    results = dict(environment=environment(), results=dict())
+    for name in args.names or sorted(BENCHMARKS):
+        print('running %s...' % name, file=sys.stderr)
+        with redirect_stdout(sys.stderr): # startup reports...
+            results['results'][name] = BENCHMARKS[name](
+                **options.get(name, dict()))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
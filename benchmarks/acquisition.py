@@ -0,0 +1,61 @@
+import asyncio
+
+from .common import temporary_datalogger
+from ..simulators import Faults, TcpSimulator, CryoConSimulator
+
+SCRIPT = """
+from functools import partial
+from datalogger.cryocon import CryoCon
+cryocons = list(map(CryoCon, %r))
+"""
+
+
+def end_to_end(n_channels=(1, 10, 50), delay=0.05, duration=5.,
+               instrument_delay=0.002, channels_per_instrument=4):
+    """
+    Samples per second stored by a headless DataLogger whose channels read
+    simulated CryoCons over TCP (one instrument per channels_per_instrument
+    channels, instrument_delay seconds to reply), each channel with the
+    given delay. The ratio to the requested rate and the lateness of the
+    scheduler are reported as well.
+    """
+    results = []
+    for run, n in enumerate(n_channels):
+        n_instruments = -(-n//channels_per_instrument)
+        # new addresses for each run: the connections are bound to the loop
+        hosts = ['127.1.%i.%i' % (run, index + 1)
+                 for index in range(n_instruments)]
+        with temporary_datalogger(SCRIPT % hosts) as dlg:
+            loop = asyncio.get_event_loop()
+            simulators = [loop.run_until_complete(TcpSimulator(
+                CryoConSimulator(), host,
+                faults=Faults(instrument_delay)).start()) for host in hosts]
+            for index in range(n):
+                dlg.new_channel()
+            for index, channel in enumerate(dlg.channels.values()):
+                channel.callback = 'partial(cryocons[%i].temp, %r)' % (
+                    index//channels_per_instrument,
+                    'ABCD'[index % channels_per_instrument])
+                channel.delay = delay
+                channel.active = True
+            loop.run_until_complete(asyncio.sleep(duration))
+            for channel in dlg.channels.values():
+                channel.active = False
+            for simulator in simulators:
+                simulator.close()
+            loop.run_until_complete(asyncio.sleep(0.1)) # disconnections
+            dlg.writer.flush()
+            rate = 0.
+            for channel in dlg.channels.values():
+                times = channel.storage.read()[0]
+                if len(times) > 1:
+                    rate += (len(times) - 1)/(times[-1] - times[0])
+            jitter = dlg.scheduler.jitter_report()
+        requested = n/delay
+        results.append(dict(
+            n_channels=n, n_instruments=n_instruments, delay=delay,
+            samples_per_second=rate, requested_per_second=requested,
+            ratio=rate/requested,
+            max_lateness=max(stats['max'] for stats in jitter.values()),
+            mean_lateness=sum(stats['mean'] for stats in jitter.values())/n))
+    return results
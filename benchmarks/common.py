@@ -0,0 +1,78 @@
+import asyncio
+import atexit
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def summary(durations):
+    """
+    Statistics (in seconds) of a list of durations.
+    """
+    durations = np.asarray(durations, dtype=float)
+    return dict(n=len(durations), mean=float(durations.mean()),
+                median=float(np.median(durations)),
+                p95=float(np.percentile(durations, 95)),
+                max=float(durations.max()))
+
+
+def timed(func, *args, **kwds):
+    start = time.perf_counter()
+    result = func(*args, **kwds)
+    return time.perf_counter() - start, result
+
+
+@contextmanager
+def temporary_datalogger(script='', gui=False, directory=None):
+    """
+    DataLogger in a temporary directory (removed at the end), with script
+    as start script, on a new event loop.
+    """
+    from ..channels import DataLogger
+    owned = directory is None
+    if owned:
+        directory = tempfile.mkdtemp(prefix='datalogger_bench_')
+    with open(os.path.join(directory, 'start_script.py'), 'w') as f:
+        f.write(script)
+    if not gui:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+    dlg = DataLogger(directory, gui=gui)
+    try:
+        yield dlg
+    finally:
+        dlg.close()
+        atexit.unregister(dlg.close) # already closed
+        if not gui:
+            loop = asyncio.get_event_loop()
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending,
+                                                   return_exceptions=True))
+            loop.close()
+        if owned:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def environment():
+    """
+    What the results depend on besides the benchmark parameters.
+    """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(commit=commit, python=sys.version.split()[0],
+                numpy=np.__version__, platform=platform.platform(),
+                processor=platform.processor(), cpus=os.cpu_count(),
+                date=time.strftime('%Y-%m-%dT%H:%M:%S'))
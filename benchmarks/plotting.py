@@ -0,0 +1,40 @@
+import os
+import time
+
+import numpy as np
+
+from .common import summary, temporary_datalogger
+
+
+def plot_point_cost(lengths=(1000, 10000, 100000, 1000000), repeat=200):
+    """
+    Duration of MyTreeWidgetItem.plot_point followed by the refresh of the
+    curve (what the refresh scheduler does for each new point), for live
+    curves of the given lengths. Runs on the offscreen Qt platform.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from ..widgets import setup_event_loop
+    except ImportError as e:
+        return dict(skipped='Qt not available: %s' % e)
+    setup_event_loop()
+    results = []
+    with temporary_datalogger(gui=True) as dlg:
+        dlg.new_channel()
+        item = list(dlg.channels.values())[0].widget
+        for length in lengths:
+            times = time.time() + np.arange(length) - length
+            item.plot_points(np.random.rand(length), times)
+            moment = times[-1]
+            plot, refresh = [], []
+            for index in range(repeat):
+                moment += 1
+                start = time.perf_counter()
+                item.plot_point(0.5, moment)
+                middle = time.perf_counter()
+                item.refresh()
+                plot.append(middle - start)
+                refresh.append(time.perf_counter() - middle)
+            results.append(dict(length=length, plot_point=summary(plot),
+                                refresh=summary(refresh)))
+    return results
@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import numpy as np
+
+from ..storage import RECORD_DTYPE
+from .common import summary, timed, temporary_datalogger
+
+CHUNK = 2**20 # records written at once when creating the files
+
+
+def write_throughput(n_points=200000, n_channels=(1, 10)):
+    """
+    Points per second through Channel.plot_and_save_point (writer service
+    and pyramid included, flushed to disk at the end).
+    """
+    results = []
+    for n in n_channels:
+        with temporary_datalogger() as dlg:
+            for index in range(n):
+                dlg.new_channel()
+            channels = list(dlg.channels.values())
+            asyncio.get_event_loop().run_until_complete(asyncio.wait(
+                [c.pyramid.catch_up_async(dlg.loader) for c in channels]))
+            per_channel = n_points//n
+            moment = time.time()
+            start = time.perf_counter()
+            for index in range(per_channel):
+                moment += 0.1
+                for channel in channels:
+                    channel.plot_and_save_point(float(index), moment)
+            loop_time = time.perf_counter() - start
+            flush_time, _ = timed(dlg.writer.close)
+        total = loop_time + flush_time
+        results.append(dict(n_channels=n, n_points=per_channel*n,
+                            seconds=total, flush_seconds=flush_time,
+                            points_per_second=per_channel*n/total))
+    return results
+
+
+def create_chan_file(filename, size, period=1.):
+    """
+    Writes a .chan file of about size bytes, with one point per period
+    ending now.
+    """
+    n_records = size//RECORD_DTYPE.itemsize
+    t_end = time.time()
+    t_start = t_end - n_records*period
+    with open(filename, 'wb') as f:
+        for start in range(0, n_records, CHUNK):
+            index = np.arange(start, min(start + CHUNK, n_records))
+            records = np.empty(len(index), dtype=RECORD_DTYPE)
+            records['time'] = t_start + index*period
+            records['value'] = np.sin(index*1e-3)
+            records.tofile(f)
+    return n_records
+
+
+def load_latency(sizes=(2**20, 10*2**20, 100*2**20), repeat=5):
+    """
+    Duration of Channel.load_data (whole file displayed) for .chan files of
+    the given sizes, and of the construction of their pyramid.
+    """
+    results = []
+    for size in sizes:
+        with temporary_datalogger() as dlg:
+            filename = dlg.open_storage('bench').path
+            creation_time, n_records = timed(create_chan_file, filename,
+                                             size)
+            start = time.perf_counter()
+            _new_channel(dlg, 'bench')
+            channel = dlg.channels['bench']
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(
+                channel.pyramid.catch_up_async(dlg.loader))
+            build_time = time.perf_counter() - start
+            dlg._days_to_show = n_records/86400. # whole file
+            durations = []
+            for index in range(repeat):
+                start = time.perf_counter()
+                loop.run_until_complete(channel.load_data())
+                durations.append(time.perf_counter() - start)
+        results.append(dict(size=size, n_records=n_records,
+                            create_seconds=creation_time,
+                            pyramid_build_seconds=build_time,
+                            load_data=summary(durations)))
+    return results
+
+
+def _new_channel(dlg, name):
+    from ..channels import Channel
+    dlg.channels[name] = Channel(dlg, name) # starts the pyramid catch-up
@@ -0,0 +1,73 @@
+import time
+
+CLOSED = 'closed' # normal operation
+OPEN = 'open' # failing: calls are refused until the backoff delay expires
+HALF_OPEN = 'half_open' # a single probe call is allowed
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a failing device.
+
+    After threshold consecutive failures, the breaker opens for backoff
+    seconds. The first call allowed afterwards is a probe: success closes
+    the breaker, failure opens it again for twice as long (up to
+    max_backoff). on_change(breaker) is called at each change of state.
+    """
+
+    def __init__(self, threshold=3, backoff=1., max_backoff=300.,
+                 on_change=None):
+        self.threshold = threshold
+        self.min_backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_change = on_change
+        self.state = CLOSED
+        self.failures = 0
+        self.backoff = backoff
+        self.retry_at = None
+        self.last_error = None
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            if self.on_change is not None:
+                self.on_change(self)
+
+    def allow(self):
+        """
+        Returns True if a call can be made now.
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() >= self.retry_at:
+            self._set_state(HALF_OPEN)
+            return True
+        return False # open, or a probe is already running
+
+    def success(self):
+        self.failures = 0
+        self.backoff = self.min_backoff
+        self.last_error = None
+        self._set_state(CLOSED)
+
+    def failure(self, error=None):
+        self.failures += 1
+        self.last_error = error
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.retry_at = time.monotonic() + self.backoff
+            self.backoff = min(2*self.backoff, self.max_backoff)
+            self._set_state(OPEN)
+
+    def __str__(self):
+        if self.state == OPEN:
+            return '%s (retry in %.0f s): %s' % (
+                self.state, max(0, self.retry_at - time.monotonic()),
+                self.last_error)
+        if self.failures:
+            return '%s (%i failures): %s' % (self.state, self.failures,
+                                             self.last_error)
+        return self.state
@@ -1,31 +1,40 @@
 import os
 import os.path as osp
-import json
 import numpy as np
 from shutil import copyfile
 import asyncio
-from asyncio import ensure_future
+from asyncio import TimeoutError
 import time
 import inspect
-from asyncio import Future, ensure_future, CancelledError, \
-    set_event_loop, TimeoutError
-import quamash
-import asyncio
-import sys
-import struct
-
-#modif Edouard
-import datetime
-
-from qtpy.QtWidgets import QApplication
-
-from .widgets import DataLoggerWidget
-
-from quamash import QEventLoop, QThreadExecutor
-#app = QApplication.instance()
-app = QApplication(sys.argv)
+import atexit
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import ChannelFile, WriterService
+from .pyramid import Pyramid
+from .config import ConfigFile
+from .scheduler import Scheduler
+from .offload import CallbackRunner
+from .breaker import CircuitBreaker, CLOSED
+from .segments import SegmentedChannelFile, SEGMENTS_SUFFIX, DAY
+from .headless import HeadlessWidget
+from . import telemetry
+from .http_server import LatestValueServer
+from . import publisher
+
+def _callback_key(func):
+    """
+    What identifies a callback across runs of the start script: the
+    instance and the code for methods, the code for functions.
+    """
+    if inspect.ismethod(func):
+        return id(func.__self__), _callback_key(func.__func__)
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return id(func)
+    return code.co_code, code.co_consts, code.co_names, func.__defaults__
 
-set_event_loop(quamash.QEventLoop())
 
 class Channel(object):
     def __init__(self, parent, name):
@@ -39,8 +48,19 @@ class Channel(object):
         self._visible = True
         self._active = False
         self._delay = 5
+        self._timeout = 0 # no timeout
 
         self.callback_func = None
+        self._call = None # the previous (possibly timed out) callback call
+        self.breaker = CircuitBreaker(on_change=self._breaker_changed)
+        self._load_request = None
+        self.storage = self.parent.open_storage(self.name)
+        self.pyramid = Pyramid(self.storage,
+                               self.parent.pyramid_path(self.name),
+                               self.parent.writer,
+                               readonly=self.parent.readonly)
+        if not self.parent.readonly: # in the background
+            self.pyramid.catch_up_async(self.parent.loader)
 
         config = self.parent.get_config_from_file()
         if self.name in config["channels"]:
@@ -49,11 +69,10 @@ class Channel(object):
             self.save_config()
         self.widget = self.create_widget()
 
-        if osp.exists(self.filename): # load existing data (widget needs to exist to plot)
-            self.load_data()
-        else: # create a data file
-            with open(self.filename, 'w') as f:
-                pass
+        if self.storage.exists(): # load existing data (widget needs to exist to plot)
+            self.parent.load_history([self])
+        elif not self.parent.readonly: # create a data file
+            self.storage.create()
 
     def create_widget(self):
         return self.parent.widget.create_channel(self)
@@ -67,12 +86,20 @@ class Channel(object):
         # twicked
         if val==self._name: # nothing changed
             return
+        if self.parent.readonly:
+            raise ValueError('Cannot rename channels in read-only mode')
+        if not self.pyramid.ready:
+            raise ValueError('Cannot rename %s before its history is '
+                             'indexed' % self._name)
         # 0. make sure no other channel has the same name
         if val in self.parent.channels.keys():
             raise ValueError('A channel named %s already exists'%val)
         # 1. change data file name
-        os.rename(self.filename, osp.join(self.parent.directory,
-                                          val + '.chan'))
+        self.parent.writer.release(self.storage)
+        storage = self.parent.open_storage(val, like=self.storage)
+        os.rename(self.storage.path, storage.path)
+        self.pyramid.move(self.parent.pyramid_path(val))
+        self.pyramid.storage = storage
         # 2. Change the name in the config file
         config = self.parent.get_config_from_file()
         config['channels'][val] = config['channels'][self._name]
@@ -83,6 +110,7 @@ class Channel(object):
         del self.parent.channels[self._name]
         # 4. Actually perform the rename
         self._name = val
+        self.storage = storage
 
     @property
     def callback(self):
@@ -119,7 +147,9 @@ class Channel(object):
     @active.setter
     def active(self, val):
         if val and not self._active: # Measurement has to be launched again
-            ensure_future(self.measure())
+            self.parent.scheduler.add(self)
+        elif not val:
+            self.parent.scheduler.remove(self)
         self._active = val
         self.save_config()
 
@@ -130,6 +160,19 @@ class Channel(object):
     @delay.setter
     def delay(self, val):
         self._delay = val
+        self.parent.scheduler.reschedule(self)
+        self.save_config()
+
+    @property
+    def timeout(self):
+        """
+        Maximum duration of a measurement in s (0: no timeout).
+        """
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, val):
+        self._timeout = val
         self.save_config()
 
     def save_config(self):
@@ -143,57 +186,137 @@ class Channel(object):
 
     @property
     def args(self):
-        return self.visible, self.active, self.delay, self.callback
+        return self.visible, self.active, self.delay, self.callback, \
+               self.timeout
 
     @args.setter
     def args(self, val):
         # set active last to trigger measurment
-        self.visible, active, self.delay, self.callback = val
+        self.visible, active, self.delay, self.callback = val[:4]
+        if len(val) > 4: # config files older than the timeout
+            self.timeout = val[4]
         self.active = active
 
 
     def load_data(self):
-        """Load data from file"""
-        with open(self.filename, 'rb') as f:
-            data = np.frombuffer(f.read(), dtype=float)
-        times = data[::2]
-        values = data[1::2]
-
-        #modif Edouard
+        """
+        Load the data more recent than parent.earliest_point from file.
 
-        values = values[times > self.parent.earliest_point]
-        times = times[times>self.parent.earliest_point]
+        The file is read in the history loader of the parent, and the curve is
+        replaced when the data arrive (the points acquired meanwhile are kept).
+        Returns the future of the read.
+        """
+        t0 = self.parent.earliest_point
+        resolution = (self.parent.latest_point - t0)/ \
+                     self.parent.widget.plot_width
+        if self.pyramid.error is not None: # raw data until the retry succeeds
+            self.pyramid.catch_up_async(self.parent.loader)
+        elif not self.pyramid.ready and \
+                self.pyramid.level_for(resolution) is not None:
+            # reads the pyramid once caught up
+            return asyncio.ensure_future(self._load_when_ready())
+        # pending points are written from here, not from the worker thread
+        self.pyramid.flush()
+        self.parent.writer.flush(self.storage)
+        future = asyncio.get_event_loop().run_in_executor(
+            self.parent.loader, self.pyramid.read, t0, None, resolution, False)
+        self._load_request = future # only the latest request is plotted
+        future.add_done_callback(self._data_loaded)
+        return future
+
+    async def _load_when_ready(self):
+        await asyncio.wait([self.pyramid.catch_up_async(self.parent.loader)])
+        return await self.load_data()
+
+    def _data_loaded(self, future):
+        if future is not self._load_request:
+            return
+        self._load_request = None
+        try:
+            times, values = future.result()
+        except BaseException as e:
+            print(self.name, ': could not load data:', e)
+            return
+        live_times = self.widget.times
+        last = times[-1] if len(times) else self.parent.earliest_point
+        new = live_times > last
+        self.plot_points(np.concatenate([values, self.widget.values[new]]),
+                         np.concatenate([times, live_times[new]]))
 
+    def read_data(self, t0=None, t1=None, resolution=None):
+        """
+        Returns (times, values) of the stored points with t0 <= time <= t1.
+        Only the requested slice of the data file is read.
 
-        self.plot_points(values, times)
+        If resolution (in seconds) is given, long windows are read from the
+        downsampling pyramid instead (min/max envelope with about one bucket
+        per resolution).
+        """
+        if resolution:
+            return self.pyramid.read(t0, t1, resolution)
+        self.parent.writer.flush(self.storage)
+        return self.storage.read(t0, t1)
 
     @property
     def filename(self):
-        return osp.join(self.parent.directory, self.name + '.chan')
+        return self.storage.path
 
     async def measure(self):
-        while(self.active):
-            try:
-                if inspect.iscoroutinefunction(self.callback_func):
-                    val = await self.callback_func()
-                else:
-                    val = self.callback_func()
-            except BaseException as e:
-                print(self.name, ':', e)
+        """
+        Performs a single measurement. Called every delay seconds by the
+        scheduler of the parent while the channel is active.
+
+        Plain function callbacks run in the pools of parent.callbacks (see
+        offload.py). A call that exceeds timeout is abandoned, and no new
+        call is started before it returns, so that a hung device can't
+        exhaust the pools.
+
+        Failing channels are only probed with an exponential backoff by
+        the circuit breaker, and keep the bus free for the healthy ones.
+        """
+        if not self.breaker.allow():
+            return
+        start = time.perf_counter()
+        try:
+            if self._call is not None and not self._call.done():
+                raise TimeoutError('previous call still running')
+            self._call = asyncio.ensure_future(
+                self.parent.callbacks.call(self.callback_func))
+            if self.timeout:
+                # shield: the thread can't be interrupted anyway
+                val = await asyncio.wait_for(asyncio.shield(self._call),
+                                             self.timeout)
             else:
-                moment = time.time()
-                self.plot_and_save_point(val, moment)
-            await asyncio.sleep(self.delay)
+                val = await self._call
+        except asyncio.CancelledError: # e.g. the scheduler is stopping
+            raise
+        except (Exception, asyncio.TimeoutError) as e:
+            if self.breaker.failures == 0:
+                print(self.name, ':', repr(e))
+            self.breaker.failure(repr(e))
+        else:
+            telemetry.record('callback', self.name,
+                             time.perf_counter() - start)
+            self.breaker.success()
+            moment = time.time()
+            self.plot_and_save_point(val, moment)
+
+    def _breaker_changed(self, breaker):
+        print(self.name, ':', breaker)
+        if hasattr(self, 'widget'):
+            self.widget.show_error_state()
 
     def plot_and_save_point(self, val, moment):
         """
         Appends a single point at the end of the curve, eventually, removes points that are too old from the curve,
         and saves the val and moment in the channel file.
         """
-        with open(self.filename, 'ab') as f:
-            f.write(struct.pack('d', moment))
-            f.write(struct.pack('d', val))
+        self.parent.writer.append(self.storage, moment, val)
+        self.pyramid.add(moment, val)
+        self.parent.latest[self] = (moment, val)
         self.parent.latest_point = moment
+        if self.parent.publisher is not None:
+            self.parent.publisher.publish(self.name, moment, val)
         self.widget.plot_point(val, moment)
 
     def plot_points(self, vals, times):
@@ -206,35 +329,153 @@ class Channel(object):
     def set_curve_visible(self, val):
         #ignores the visibility toggle until the widget attr has been successfully loaded
         if hasattr(self, 'widget'):
-            self.widget.curve.setVisible(val)
+            self.widget.set_visible(val)
 
 class DataLogger(object):
-    def __init__(self, directory=None):
+    LOADER_THREADS = 4 # threads reading the history of the channels
+    READONLY_REFRESH = 10. # s, period of the data reloads in read-only mode
+
+    def __init__(self, directory=None, gui=True, readonly=False):
         """
         If directory is None, uses the default home directory (+.datalogger)
+
+        With gui=False, no Qt module is imported and the DataLogger runs on
+        the current asyncio event loop (see run_headless.py).
+        With readonly=True, nothing is acquired nor written: the DataLogger
+        only displays (and periodically reloads) the data of the directory,
+        e.g. as a front end of a headless DataLogger.
+
+        The duration of each step of the startup is printed at the end (see
+        startup_report).
         """
+        self.startup_times = OrderedDict() # step -> duration (s)
+        self._startup = time.perf_counter()
+        self.gui = gui
+        self.readonly = readonly
+        if gui:
+            with self.startup_step('Qt'):
+                from .widgets import setup_event_loop
+                setup_event_loop()
         self._days_to_show = 0.01
         self.latest_point = time.time()
         self.channels = dict()
+        self.latest = dict() # channel -> (time, value) of its last point
+        self.loader = ThreadPoolExecutor(max_workers=self.LOADER_THREADS)
+        self._n_loading = 0
+        self._n_loaded = 0
         if directory is None:
-            directory = osp.join(os.environ["HOMEDRIVE"], os.environ[
-                "HOMEPATH"], '.datalogger')
+            if "HOMEDRIVE" in os.environ:
+                directory = osp.join(os.environ["HOMEDRIVE"], os.environ[
+                    "HOMEPATH"], '.datalogger')
+            else:
+                directory = osp.join(osp.expanduser('~'), '.datalogger')
         self.directory = directory
         if not osp.exists(self.directory):
             os.mkdir(self.directory)
+        self.config = ConfigFile(self.config_file, readonly=readonly)
 
-        if not osp.exists(self.script_file):
+        if not osp.exists(self.script_file) and not readonly:
             copyfile(osp.join(osp.dirname(__file__),
                                'start_script_template.py'),
                       self.script_file)
 
         self.script_globals = dict()
         self.script_locals = dict()
-        self.run_start_script()
-
+        if not readonly: # no instrument connection in read-only mode
+            with self.startup_step('start script'):
+                self.run_start_script()
+
+        self.writer = WriterService(
+            **self.get_config_from_file().get("writer", dict()))
+        self.storage_options = self.get_config_from_file().get("storage",
+                                                               dict())
+        self.scheduler = Scheduler(
+            **self.get_config_from_file().get("scheduler", dict()))
+        if not readonly:
+            self.scheduler.start()
+        self.loop_monitor = telemetry.LoopLagMonitor()
+        self.loop_monitor.start()
+        self.http = None
+        http_options = self.get_config_from_file().get("http")
+        if http_options is not None: # e.g. {"port": 8765}
+            self.http = LatestValueServer(self, **http_options)
+            self.http.start()
+        self.publisher = None
+        self._follower = None
+        publisher_options = self.get_config_from_file().get("publisher")
+        if publisher_options is not None: # e.g. {"port": 8766}
+            address = publisher.options(publisher_options, self.directory)
+            if readonly: # follows the DataLogger that publishes
+                self._follower = asyncio.ensure_future(self._follow(address))
+            else:
+                self.publisher = publisher.Publisher(
+                    backlog=publisher_options.get("backlog", 1000),
+                    **address)
+                self.publisher.start()
+        self.callbacks = CallbackRunner()
+        atexit.register(self.close)
         self.load_config()
-        self.widget = DataLoggerWidget(self)
-        self.load_channels()
+        with self.startup_step('widgets'):
+            if gui:
+                from .widgets import DataLoggerWidget
+                self.widget = DataLoggerWidget(self)
+            else:
+                self.widget = HeadlessWidget()
+        with self.startup_step('channels'):
+            self.load_channels()
+        if readonly:
+            self._refresh_readonly()
+        print(self.startup_report())
+
+    @contextmanager
+    def startup_step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_times[name] = time.perf_counter() - start
+
+    def startup_report(self):
+        """
+        Returns a summary of the time spent in each step of the startup
+        (and in the lazy imports of the package).
+        """
+        from . import import_times
+        lines = ['DataLogger started in %.2f s:' % (time.perf_counter() -
+                                                    self._startup)]
+        for name, duration in self.startup_times.items():
+            lines.append('    %-20s %.3f s' % (name, duration))
+        for name, duration in sorted(import_times.items()):
+            lines.append('    import %-13s %.3f s' % (name, duration))
+        return '\n'.join(lines)
+
+    async def _follow(self, address):
+        """
+        Plots the points published by the acquiring DataLogger as they
+        arrive (read-only mode), reconnecting if needed.
+        """
+        while True:
+            subscription = publisher.Subscription(**address)
+            try:
+                await subscription.connect()
+                async for name, moment, val in subscription:
+                    channel = self.channels.get(name)
+                    if channel is None:
+                        continue
+                    self.latest[channel] = (moment, val)
+                    self.latest_point = max(self.latest_point, moment)
+                    channel.widget.plot_point(val, moment)
+            except OSError:
+                pass
+            finally:
+                subscription.close()
+            await asyncio.sleep(self.READONLY_REFRESH)
+
+    def _refresh_readonly(self):
+        self.latest_point = time.time()
+        self.load_history(self.channels.values())
+        asyncio.get_event_loop().call_later(self.READONLY_REFRESH,
+                                            self._refresh_readonly)
 
 
     @property
@@ -245,8 +486,29 @@ class DataLogger(object):
     def days_to_show(self, val):
         self._days_to_show = val
         self.save_config()
-        for ch in self.channels.values():
-            ch.load_data()
+        self.load_history(self.channels.values())
+
+    def load_history(self, channels):
+        """
+        Reloads the data of channels in parallel in the background, and shows
+        the progress in the status bar.
+        """
+        if not self.gui: # nothing to display
+            return
+        for channel in channels:
+            self._n_loading += 1
+            channel.load_data().add_done_callback(self._history_loaded)
+        self._show_loading_progress()
+
+    def _history_loaded(self, future):
+        self._n_loaded += 1
+        self._show_loading_progress()
+
+    def _show_loading_progress(self):
+        if self._n_loaded == self._n_loading:
+            self._n_loading = self._n_loaded = 0
+        if hasattr(self, 'widget'):
+            self.widget.show_loading_progress(self._n_loaded, self._n_loading)
 
     def save_config(self):
         config = self.get_config_from_file()
@@ -264,11 +526,105 @@ class DataLogger(object):
         #earliest_point = time.mktime(loadstart_date.timetuple())
         return earliest_point
 
+    def close(self):
+        """
+        Writes all the pending points and config modifications to disk.
+        """
+        self.writer.close() # first, so that no failure below loses points
+        self.scheduler.stop()
+        self.loop_monitor.stop()
+        if self.http is not None:
+            self.http.close()
+        if self.publisher is not None:
+            self.publisher.close()
+        if self._follower is not None:
+            self._follower.cancel()
+        self.callbacks.shutdown()
+        self.loader.shutdown(wait=False)
+        self.config.flush()
+
+    def latest_values(self):
+        """
+        Returns {channel name: {"time", "value", "error", "state"}} with the
+        last point of each channel (time and value are None before the
+        first point), error is True if the callback is invalid or the
+        device is failing.
+        """
+        values = dict()
+        for name, channel in self.channels.items():
+            moment, val = self.latest.get(channel, (None, None))
+            values[name] = dict(time=moment, value=val,
+                                error=channel.error_state or
+                                      channel.breaker.state != CLOSED,
+                                state=channel.breaker.state)
+        return values
+
+    def telemetry_report(self):
+        """
+        Returns the telemetry of the acquisition: duration histograms (see
+        telemetry.py), effective sampling period vs delay of the channels,
+        and state of the instrument queues.
+        """
+        from .serial_interface import queue_stats
+        jitter = self.scheduler.jitter_report()
+        sampling = dict()
+        for name, channel in self.channels.items():
+            stats = jitter.get(name, dict())
+            sampling[name] = dict(delay=channel.delay,
+                                  period=stats.get('period'),
+                                  lateness_mean=stats.get('mean'),
+                                  lateness_max=stats.get('max'),
+                                  overruns=stats.get('overruns'),
+                                  skipped=stats.get('skipped'),
+                                  breaker=str(channel.breaker))
+        return dict(time=time.time(), histograms=telemetry.histograms(),
+                    sampling=sampling, queues=queue_stats())
+
+    def dump_telemetry(self, filename):
+        telemetry.dump(filename, self.telemetry_report())
+
     def run_start_script(self):
-        self.script_locals = dict()
-        self.script_globals = dict()
-        with open(self.script_file, 'r') as f:
-            exec(f.read(), self.script_globals, self.script_locals)
+        """
+        Executes the start script again in a new namespace, and rebinds the
+        callbacks of all the channels at once (nothing changes if the script
+        fails). The instruments are not re-created (see SerialInstrument).
+        Returns the names of the channels whose callback changed.
+        """
+        script_globals = dict()
+        script_locals = dict()
+        try:
+            with open(self.script_file, 'r') as f:
+                code = compile(f.read(), self.script_file, 'exec')
+            exec(code, script_globals, script_locals)
+        except Exception as e: # SyntaxError included
+            if not self.channels: # first run
+                raise
+            print('Start script failed, callbacks unchanged:', repr(e))
+            return []
+        funcs = dict()
+        for name, channel in self.channels.items():
+            try:
+                funcs[name] = eval(channel.callback, script_globals,
+                                   script_locals)
+            except BaseException as e:
+                funcs[name] = None
+        # no await below: the scheduler sees all the new callbacks at once
+        self.script_globals = script_globals
+        self.script_locals = script_locals
+        changed = []
+        for name, func in funcs.items():
+            channel = self.channels[name]
+            old = channel.callback_func
+            if func is None or old is None or \
+                    _callback_key(func) != _callback_key(old):
+                changed.append(name)
+            channel.error_state = func is None
+            channel.callback_func = func
+            channel.widget.show_error_state()
+        if self.channels:
+            print('Start script reloaded, changed callbacks: %s' % (
+                ', '.join(sorted(changed)) or 'none'))
+        return changed
 
 
     def load_channels(self):
@@ -292,6 +648,38 @@ class DataLogger(object):
             name = 'new_channel' + str(index)
         return name
 
+    def open_storage(self, name, like=None):
+        """
+        Returns the storage object holding the data of channel name.
+
+        Existing data are opened in whatever layout they are (single
+        <name>.chan file or <name>.segments directory). New channels use the
+        layout of the "storage" entry of the config file, e.g.
+        {"layout": "segmented", "period_days": 1, "max_mb": null}.
+        If like is given, its layout is used instead (renaming).
+        """
+        filename = osp.join(self.directory, name + '.chan')
+        path = osp.join(self.directory, name + SEGMENTS_SUFFIX)
+        if like is not None:
+            segmented = isinstance(like, SegmentedChannelFile)
+        elif osp.isdir(path):
+            segmented = True
+        elif osp.exists(filename):
+            segmented = False
+        else:
+            segmented = self.storage_options.get('layout') == 'segmented'
+        if not segmented:
+            return ChannelFile(filename)
+        period_days = self.storage_options.get('period_days', 1)
+        max_mb = self.storage_options.get('max_mb')
+        return SegmentedChannelFile(path,
+                                    period=period_days and period_days*DAY,
+                                    max_bytes=max_mb and int(max_mb*2**20),
+                                    readonly=self.readonly)
+
+    def pyramid_path(self, name):
+        return osp.join(self.directory, name + '.pyramid')
+
     @property
     def config_file(self):
         return osp.join(self.directory, 'datalogger.conf')
@@ -301,11 +689,14 @@ class DataLogger(object):
         return osp.join(self.directory, 'start_script.py')
 
     def get_config_from_file(self):
-        if not osp.exists(self.config_file):
-            return dict()
-        with open(self.config_file, 'r') as f:
-            return json.load(f)
+        """
+        Returns the cached content of the config file (only read again if the
+        file has been modified by someone else).
+        """
+        return self.config.data
 
     def write_config_to_file(self, config_dict):
-        with open(self.config_file, 'w') as f:
-            json.dump(config_dict, f)
+        """
+        The config file is written after a debounce delay.
+        """
+        self.config.data = config_dict
@@ -0,0 +1,97 @@
+import os
+import json
+import asyncio
+from contextlib import contextmanager
+
+
+class ConfigFile(object):
+    """
+    In-memory copy of the json config file of a DataLogger.
+
+    The file is read once, and read again only if its modification time
+    changes behind our back. Modifications of data are written after a
+    debounce delay (save), in a temporary file that atomically replaces the
+    config file. Within a batch, nothing is scheduled before the end of the
+    batch. A readonly ConfigFile never writes the file.
+    """
+    DEBOUNCE = 0.5 # s
+
+    def __init__(self, filename, readonly=False):
+        self.filename = filename
+        self.readonly = readonly
+        self._data = None
+        self._mtime = None
+        self._timer = None
+        self._dirty = False
+        self._batch_depth = 0
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.filename).st_mtime_ns
+        except OSError:
+            return None
+
+    @property
+    def data(self):
+        """
+        The config dictionary. It can be modified in place, followed by a
+        call to save.
+        """
+        mtime = self._file_mtime()
+        # pending modifications take precedence over the file
+        if self._data is None or (mtime != self._mtime and not self._dirty):
+            self.reload()
+        return self._data
+
+    @data.setter
+    def data(self, val):
+        self._data = val
+        self.save()
+
+    def reload(self):
+        self._mtime = self._file_mtime()
+        if self._mtime is None:
+            self._data = dict()
+        else:
+            with open(self.filename, 'r') as f:
+                self._data = json.load(f)
+
+    def save(self):
+        """
+        Schedules the writing of the file.
+        """
+        if self.readonly:
+            return
+        self._dirty = True
+        if self._timer is None and not self._batch_depth:
+            self._timer = asyncio.get_event_loop().call_later(self.DEBOUNCE,
+                                                              self.flush)
+
+    def flush(self):
+        """
+        Writes the pending modifications immediately.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._dirty:
+            return
+        self._dirty = False
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._data, f)
+        os.replace(tmp, self.filename)
+        self._mtime = self._file_mtime()
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups all the modifications made in a with block in one write.
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._dirty and not self._batch_depth:
+                self.save()
@@ -3,8 +3,8 @@ import serial
 from io import StringIO
 import numpy as np
 
-from wiznet import SerialFromEthernet
-from .serial_interface import SerialInstrument
+from .wiznet import SerialFromEthernet
+from .serial_interface import SerialInstrument, PRIORITY_INTERACTIVE
 
 
 def curve_2_340(filename):
@@ -132,9 +132,10 @@ class CryoCon_old(object):
         self.set_curve(index, name, 'ACR', coeff, 'LogOhm', curve)
 
 class CryoCon(SerialInstrument):
+    BATCH_QUERIES = True # e.g. "INPUT A:TEMPER?;INPUT B:TEMPER?"
 
     def __init__(self, ip_or_port, **kwds):
-        super(CryoCon, self).__init__()
+        super(CryoCon, self).__init__(ip_or_port, **kwds)
         self.serial.linebreak='\n\r'
         self.serial.timeout = 2
         self.serial.parity = serial.PARITY_NONE
@@ -145,7 +146,7 @@ class CryoCon(SerialInstrument):
 
 
     async def temp(self, ch='A'):
-        string = await self.serial.ask("INPUT %s:TEMPER?"%ch)
+        string = await self.ask("INPUT %s:TEMPER?"%ch)
         return float(string)
 
     async def temp_chA(self):
@@ -155,17 +156,18 @@ class CryoCon(SerialInstrument):
         return await self.temp("B")
 
     async def idn(self):
-        string = await self.serial.ask('*IDN?')
+        string = await self.serial.ask('*IDN?', priority=PRIORITY_INTERACTIVE)
         return string
 
     async def get_control(self):
-        return await self.serial.ask("CONTROL?")
+        return await self.serial.ask("CONTROL?",
+                                     priority=PRIORITY_INTERACTIVE)
 
     async def set_control(self, val):
         if val:
             await self.serial.write("CONTROL ON")
         else:
-            self.stop_control()
+            await self.stop_control()
 
     async def stop_control(self):
         await self.serial.write("STOP")
@@ -0,0 +1,31 @@
+"""
+Stand-ins for the Qt widgets when a DataLogger runs without GUI.
+"""
+import numpy as np
+
+
+class HeadlessChannelWidget(object):
+    times = np.empty(0)
+    values = np.empty(0)
+
+    def plot_point(self, val, moment):
+        pass
+
+    def plot_points(self, vals, times):
+        pass
+
+    def set_visible(self, val):
+        pass
+
+    def show_error_state(self):
+        pass
+
+
+class HeadlessWidget(object):
+    plot_width = 1000
+
+    def create_channel(self, channel):
+        return HeadlessChannelWidget()
+
+    def show_loading_progress(self, n_loaded, n_loading):
+        pass
@@ -2,7 +2,6 @@ from serial import Serial
 from .wiznet import  SerialFromEthernet
 import numpy as np
 import time
-import matplotlib.pylab as plt
 from .serial_interface import SerialInstrument
 import serial
 
@@ -63,7 +62,8 @@ class HeliumDepth_old(object):
                     time_ticks.append(str(int(time.strftime("%H",
                                                             time.gmtime())) + 1) + time.strftime(
                         ":%M:%S", time.gmtime()))
-                    '''plt.close("all")
+                    '''import matplotlib.pylab as plt
+                    plt.close("all")
                     plt.plot(times, levels)
                     ax = plt.gca()
                     ax.set_xticklabels(time_ticks)
@@ -0,0 +1,123 @@
+"""
+Minimal HTTP endpoint serving the latest value of each channel, for the
+dashboards and the other lab software (no access to the instruments or
+the data files). Enabled with "http": {"port": 8765} in the config file:
+
+    GET /latest     JSON {"time": now, "channels": {name: {"time", "value",
+                    "error", "state"}}}
+    GET /metrics    Prometheus text format
+
+Bound to localhost unless another "host" is given.
+"""
+import asyncio
+import json
+import math
+import time
+
+JSON = 'application/json'
+PROMETHEUS = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _finite(val):
+    try:
+        val = float(val)
+    except (TypeError, ValueError):
+        return None
+    return val if math.isfinite(val) else None
+
+
+def _label(name):
+    return name.replace('\\', '\\\\').replace('"', '\\"').replace('\n',
+                                                                  '\\n')
+
+
+def latest_json(values):
+    channels = dict()
+    for name, latest in values.items():
+        channels[name] = dict(latest, value=_finite(latest['value']))
+    return json.dumps(dict(time=time.time(), channels=channels))
+
+
+def latest_prometheus(values):
+    lines = ['# HELP datalogger_value Latest value of the channel',
+             '# TYPE datalogger_value gauge']
+    for name, latest in sorted(values.items()):
+        val = _finite(latest['value'])
+        if latest['time'] is not None:
+            lines.append('datalogger_value{channel="%s"} %s %i' % (
+                _label(name), 'NaN' if val is None else repr(val),
+                1000*latest['time']))
+    lines += ['# HELP datalogger_timestamp_seconds Time of the latest value',
+              '# TYPE datalogger_timestamp_seconds gauge']
+    for name, latest in sorted(values.items()):
+        if latest['time'] is not None:
+            lines.append('datalogger_timestamp_seconds{channel="%s"} %r' % (
+                _label(name), latest['time']))
+    lines += ['# HELP datalogger_error 1 if the channel is failing',
+              '# TYPE datalogger_error gauge']
+    for name, latest in sorted(values.items()):
+        lines.append('datalogger_error{channel="%s"} %i' % (
+            _label(name), latest['error']))
+    return '\n'.join(lines) + '\n'
+
+
+class LatestValueServer(object):
+    """
+    Serves datalogger.latest_values() on (host, port). Each request is
+    answered from memory: the cost is independent of the acquisition.
+    """
+    TIMEOUT = 5. # s, to receive the request
+
+    ROUTES = {'/latest': (latest_json, JSON),
+              '/metrics': (latest_prometheus, PROMETHEUS)}
+
+    def __init__(self, datalogger, port=8765, host='127.0.0.1'):
+        self.datalogger = datalogger
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        return asyncio.ensure_future(self._start())
+
+    async def _start(self):
+        try:
+            self.server = await asyncio.start_server(self._serve, self.host,
+                                                     self.port)
+        except OSError as e:
+            print('HTTP endpoint not started on %s:%i: %s' % (
+                self.host, self.port, e))
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                             self.TIMEOUT)
+            method, path = request.split(b' ', 2)[:2]
+            path = path.decode('latin-1').split('?')[0].rstrip('/')
+            if method not in (b'GET', b'HEAD'):
+                status, body, content_type = '405 Method Not Allowed', '', \
+                                             'text/plain'
+            elif path in self.ROUTES:
+                formatter, content_type = self.ROUTES[path]
+                status = '200 OK'
+                body = formatter(self.datalogger.latest_values())
+            else:
+                status, body, content_type = '404 Not Found', \
+                    'try /latest or /metrics\n', 'text/plain'
+            body = body.encode()
+            writer.write(('HTTP/1.0 %s\r\nContent-Type: %s\r\n'
+                          'Content-Length: %i\r\nConnection: close\r\n\r\n'
+                          % (status, content_type, len(body))).encode())
+            if method != b'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
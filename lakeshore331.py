@@ -9,9 +9,10 @@ class LakeShore331(SerialInstrument):
     parity = 'O'
     bytesize = 7
     linebreak = '\r\n'
+    BATCH_QUERIES = True # e.g. "KRDG? A;KRDG? B"
 
     async def temp(self, ch='A'):
-        string = await self.serial.ask("KRDG? " + ch)
+        string = await self.ask("KRDG? " + ch)
         return float(string)
 
     async def temp_chA(self):
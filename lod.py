@@ -0,0 +1,146 @@
+"""
+Level-of-detail fetching of the data displayed in the plot.
+
+When the user zooms or pans (i.e. when the x-axis is not auto-ranging), the
+visible time span is fetched from the storage at a resolution matched to
+the plot width. The time axis is cut in tiles of a fixed number of buckets
+of each pyramid level (or a fixed duration of raw data), and the completed
+tiles are kept in a bounded LRU cache.
+"""
+import asyncio
+from collections import OrderedDict
+import numpy as np
+
+from .pyramid import envelope
+from . import telemetry
+
+
+class TileCache(object):
+    """
+    LRU cache of (times, values) tiles, holding at most max_points points.
+    """
+
+    def __init__(self, max_points=5*10**6):
+        self.max_points = max_points
+        self.n_points = 0
+        self._tiles = OrderedDict()
+
+    def get(self, key):
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+        return tile
+
+    def put(self, key, tile):
+        if key in self._tiles:
+            self.n_points -= len(self._tiles.pop(key)[0])
+        self._tiles[key] = tile
+        self.n_points += len(tile[0])
+        while self.n_points > self.max_points and len(self._tiles) > 1:
+            _, old = self._tiles.popitem(last=False)
+            self.n_points -= len(old[0])
+
+    def clear(self):
+        self._tiles.clear()
+        self.n_points = 0
+
+
+class ViewportLoader(object):
+    """
+    Fetches the visible part of all visible curves asynchronously, in the
+    executor of the event loop. refresh is to be called when the view range
+    changes; a refresh that is superseded by a newer one before its tiles
+    arrive is dropped.
+    """
+    TILE_BUCKETS = 1024 # tile length in buckets of the level
+    RAW_TILE = 600. # tile length in s for the raw data
+    PREFETCH = 0.5 # fraction of the view fetched on each side
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.cache = TileCache()
+        self.generation = 0
+
+    @property
+    def active(self):
+        """
+        True when the user has taken over the x-range of the plot.
+        """
+        return not self.widget.plot_item.vb.autoRangeEnabled()[0]
+
+    def tile_length(self, width):
+        return width*self.TILE_BUCKETS if width else self.RAW_TILE
+
+    def refresh(self):
+        self.generation += 1
+        return asyncio.ensure_future(self._refresh(self.generation))
+
+    async def _refresh(self, generation):
+        x0, x1 = self.widget.plot_item.vb.viewRange()[0]
+        span = x1 - x0
+        resolution = span/self.widget.plot_width
+        x0 -= span*self.PREFETCH
+        x1 += span*self.PREFETCH
+        loop = asyncio.get_event_loop()
+        requests = []
+        for item in self.widget.tree.items:
+            if not item.channel.visible:
+                continue
+            pyramid = item.channel.pyramid
+            level = pyramid.level_for(resolution)
+            width = level.width if level else 0
+            # pending points are written here, from the GUI thread. Tiles
+            # ending after completed may still grow: they are not cached.
+            if level is None:
+                completed = item.channel.parent.latest_point
+                item.channel.parent.writer.flush(pyramid.storage)
+                if item.channel.parent.readonly: # written by another process
+                    completed = pyramid.storage.last_time() or 0.
+            elif not pyramid.ready: # the catch-up is filling the level
+                completed = 0.
+            elif level.current is not None:
+                completed = level.current[0]
+                pyramid.flush()
+            else: # no point added here (e.g. read-only mode)
+                last = level.file.last_time()
+                completed = 0. if last is None else last + level.width
+            first = pyramid.first_time()
+            if first is None:
+                continue
+            length = self.tile_length(width)
+            start = max(x0, first)
+            stop = min(x1, item.channel.parent.latest_point)
+            tiles = []
+            for index in range(int(start // length), int(stop // length) + 1):
+                key = (item.channel, width, index)
+                tile = self.cache.get(key)
+                if tile is None:
+                    tile = loop.run_in_executor(None, pyramid.tile, width,
+                                                index*length,
+                                                (index + 1)*length)
+                    if (index + 1)*length > completed:
+                        key = None # still growing: not cached
+                tiles.append((key, tile))
+            requests.append((item, level, tiles))
+        for item, level, tiles in requests:
+            for index, (key, tile) in enumerate(tiles):
+                if asyncio.isfuture(tile):
+                    tile = await tile
+                    if key is not None:
+                        self.cache.put(key, tile)
+                tiles[index] = tile
+        if generation != self.generation or not self.active:
+            return # a newer view has been requested meanwhile
+        with telemetry.timed('redraw', 'view'):
+            self._show(requests, x0, x1)
+
+    def _show(self, requests, x0, x1):
+        for item, level, tiles in requests:
+            if level is not None and level.current is not None and \
+                    x0 - level.width <= level.current[0] <= x1:
+                current = np.array([tuple(level.current)],
+                                   dtype=level.file.dtype)
+                tiles.append(envelope(current, level.width))
+            times = np.concatenate([tile[0] for tile in tiles])
+            values = np.concatenate([tile[1] for tile in tiles])
+            item.show_view(times, values)
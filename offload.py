@@ -0,0 +1,75 @@
+"""
+Execution of the channel callbacks.
+
+Coroutine callbacks run on the event loop. Plain functions (blocking
+drivers such as OpticReader.count) run in a bounded thread pool, so that
+they only delay their own channel. Two decorators, to be used in the start
+script, change this default:
+
+    @cpu_bound  # runs in a process pool (the function has to be picklable,
+    def fit():  # i.e. defined at the top level of an importable module)
+        ...
+
+    @inline     # runs on the event loop (e.g. for drivers that are not
+    def fast(): # thread-safe)
+        ...
+"""
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+THREAD = 'thread'
+PROCESS = 'process'
+INLINE = 'inline'
+
+
+def cpu_bound(func):
+    func.execution = PROCESS
+    return func
+
+
+def inline(func):
+    func.execution = INLINE
+    return func
+
+
+class CallbackRunner(object):
+    """
+    Runs the callbacks according to their kind. The pools are created on
+    first use.
+    """
+    MAX_THREADS = 8
+    MAX_PROCESSES = 2
+
+    def __init__(self):
+        self._threads = None
+        self._processes = None
+
+    def executor(self, execution):
+        if execution == PROCESS:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(self.MAX_PROCESSES)
+            return self._processes
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(self.MAX_THREADS,
+                                               thread_name_prefix='callback')
+        return self._threads
+
+    def call(self, func):
+        """
+        Returns an awaitable of the result of func().
+        """
+        if inspect.iscoroutinefunction(func):
+            return func()
+        execution = getattr(func, 'execution', THREAD)
+        if execution == INLINE:
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(func())
+            return future
+        return asyncio.get_event_loop().run_in_executor(
+            self.executor(execution), func)
+
+    def shutdown(self):
+        for pool in self._threads, self._processes:
+            if pool is not None:
+                pool.shutdown(wait=False)
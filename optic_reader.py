@@ -1,6 +1,11 @@
-import requests
 import numpy as np
 
+
+def _get(url):
+    import requests # slow to import, only needed when counting
+    return requests.get(url)
+
+
 class OpticReader(object):
     def __init__(self, ip='10.214.1.81'):
         self.ip = ip
@@ -9,7 +14,7 @@ class OpticReader(object):
 
 
     def count(self):
-        r = requests.get("http://"+self.ip+"/Python")
+        r = _get("http://"+self.ip+"/Python")
         data = r.content.split(b';')
         count = float(data[0])
         t = float(data[1])
@@ -19,7 +24,7 @@ class OpticReader(object):
         return count
 
     def time(self):
-        r = requests.get("http://"+self.ip+"/Python")
+        r = _get("http://"+self.ip+"/Python")
         data = r.content.split(';')
         count = float(data[0])
         t = float(data[1])
@@ -28,7 +33,7 @@ class OpticReader(object):
         return t
 
     def derivative(self):
-        r = requests.get("http://" + self.ip + "/Python")
+        r = _get("http://" + self.ip + "/Python")
         data = r.content.split(b';')
         count = float(data[0])
         t = float(data[1])
@@ -0,0 +1,215 @@
+"""
+Live stream of the new points, for viewers and analysis scripts that
+follow the acquisition without polling the data files. Enabled with
+"publisher": {...} in the config file: {"path": socket file} for a Unix
+domain socket (the default is <directory>/datalogger.sock), or
+{"port": 8766} for TCP (bound to 127.0.0.1 unless "host" is given).
+"backlog" is the number of points sent on connection (default 1000).
+
+Framing (little endian): each frame is a header (type: uint8, payload
+length: uint32) followed by the payload:
+    - CHANNEL (server): uint16 channel id + utf-8 name, sent before the
+      first point of a channel
+    - POINT (server): uint16 channel id + float64 time + float64 value
+    - SUBSCRIBE (client): utf-8 channel names separated by '\n' (empty:
+      all the channels). Can be sent again to change the filter; the
+      backlog is sent after each subscription.
+"""
+import asyncio
+import os
+import socket
+import struct
+from collections import deque
+
+CHANNEL = 1
+POINT = 2
+SUBSCRIBE = 3
+
+HEADER = struct.Struct('<BI')
+CHANNEL_ID = struct.Struct('<H')
+POINT_DATA = struct.Struct('<Hdd')
+
+
+def frame(kind, payload):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+async def read_frame(reader):
+    kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return kind, await reader.readexactly(length)
+
+
+class _Subscriber(object):
+    def __init__(self, writer):
+        self.writer = writer
+        self.channels = None # None: all
+        self.announced = set() # ids of the channels already sent
+
+    def wants(self, name):
+        return self.channels is None or name in self.channels
+
+    def send(self, channel_id, name, point):
+        if channel_id not in self.announced:
+            self.announced.add(channel_id)
+            self.writer.write(frame(CHANNEL, CHANNEL_ID.pack(channel_id) +
+                                    name.encode()))
+        self.writer.write(frame(POINT, point))
+
+
+class Publisher(object):
+    """
+    Sends each point given to publish to the subscribers interested in its
+    channel. The last backlog points are kept for the new subscribers.
+    A subscriber that doesn't keep up (more than MAX_BUFFER bytes waiting
+    to be sent) is disconnected: it can reconnect and get the backlog.
+    """
+    MAX_BUFFER = 2**20
+
+    def __init__(self, path=None, port=None, host='127.0.0.1', backlog=1000):
+        self.path = path
+        self.port = port
+        self.host = host
+        self.backlog = deque(maxlen=backlog) # (id, name, packed point)
+        self._ids = dict() # channel name -> id
+        self._subscribers = set()
+        self.server = None
+
+    def start(self):
+        return asyncio.ensure_future(self._start())
+
+    async def _start(self):
+        try:
+            if self.path is not None:
+                if os.path.exists(self.path): # left by a previous run
+                    os.remove(self.path)
+                self.server = await asyncio.start_unix_server(self._serve,
+                                                              self.path)
+            else:
+                self.server = await asyncio.start_server(self._serve,
+                                                         self.host,
+                                                         self.port)
+        except OSError as e:
+            print('Publisher not started on %s: %s' % (self.address, e))
+
+    @property
+    def address(self):
+        return self.path or '%s:%s' % (self.host, self.port)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
+        for subscriber in list(self._subscribers):
+            subscriber.writer.close()
+
+    def publish(self, name, moment, val):
+        channel_id = self._ids.get(name)
+        if channel_id is None:
+            channel_id = self._ids[name] = len(self._ids)
+        point = POINT_DATA.pack(channel_id, moment, val)
+        self.backlog.append((channel_id, name, point))
+        for subscriber in list(self._subscribers):
+            if subscriber.wants(name):
+                subscriber.send(channel_id, name, point)
+                self._check(subscriber)
+
+    def _check(self, subscriber):
+        transport = subscriber.writer.transport
+        if transport.get_write_buffer_size() > self.MAX_BUFFER:
+            self._subscribers.discard(subscriber)
+            transport.abort()
+
+    async def _serve(self, reader, writer):
+        subscriber = _Subscriber(writer)
+        try:
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind != SUBSCRIBE:
+                    continue
+                names = payload.decode().split('\n')
+                subscriber.channels = set(names) if any(names) else None
+                self._subscribers.add(subscriber)
+                for channel_id, name, point in list(self.backlog):
+                    if subscriber.wants(name):
+                        subscriber.send(channel_id, name, point)
+                self._check(subscriber)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._subscribers.discard(subscriber)
+            writer.close()
+
+
+class Subscription(object):
+    """
+    Client of a Publisher:
+
+        subscription = Subscription(path=...)  # or port=...
+        await subscription.connect(['temperature'])  # None: all channels
+        async for name, moment, val in subscription:
+            ...
+    """
+
+    def __init__(self, path=None, port=None, host='127.0.0.1'):
+        self.path = path
+        self.port = port
+        self.host = host
+        self.reader = None
+        self.writer = None
+        self.names = dict() # channel id -> name
+
+    async def connect(self, channels=None):
+        if self.path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(
+                self.path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+        self.subscribe(channels)
+
+    def subscribe(self, channels=None):
+        self.writer.write(frame(SUBSCRIBE, '\n'.join(channels or []).encode()))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def read(self):
+        """
+        Returns the next (channel name, time, value).
+        """
+        while True:
+            kind, payload = await read_frame(self.reader)
+            if kind == CHANNEL:
+                channel_id, = CHANNEL_ID.unpack_from(payload)
+                self.names[channel_id] = payload[CHANNEL_ID.size:].decode()
+            elif kind == POINT:
+                channel_id, moment, val = POINT_DATA.unpack(payload)
+                return self.names[channel_id], moment, val
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.read()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            raise StopAsyncIteration
+
+
+def options(config, directory):
+    """
+    Keyword arguments of Publisher and Subscription from the "publisher"
+    section of the config file.
+    """
+    config = dict(config)
+    config.pop('backlog', None)
+    if 'port' not in config and 'path' not in config:
+        if hasattr(socket, 'AF_UNIX'):
+            config['path'] = os.path.join(directory, 'datalogger.sock')
+        else:
+            config['port'] = 8766
+    return config
@@ -0,0 +1,262 @@
+"""
+Multi-resolution min/max/mean summaries of the channel data.
+
+For each bucket width of Pyramid.WIDTHS, the completed buckets of a channel
+are stored in <name>.pyramid/<width>s.pyr as records
+(time, min, max, mean, count), where time is the start of the bucket.
+Long time windows are rendered from these files instead of the raw data.
+"""
+import os
+import os.path as osp
+import time
+import asyncio
+import numpy as np
+
+from .storage import ChannelFile
+
+BUCKET_DTYPE = np.dtype([('time', float), ('min', float), ('max', float),
+                         ('mean', float), ('count', float)])
+
+
+def aggregate(times, values, width):
+    """
+    Returns the buckets (array of BUCKET_DTYPE) of the sorted points.
+    """
+    if not len(times):
+        return np.empty(0, dtype=BUCKET_DTYPE)
+    keys = np.floor_divide(times, width)
+    starts = np.r_[0, np.flatnonzero(np.diff(keys)) + 1]
+    counts = np.diff(np.r_[starts, len(times)])
+    buckets = np.empty(len(starts), dtype=BUCKET_DTYPE)
+    buckets['time'] = keys[starts]*width
+    buckets['min'] = np.minimum.reduceat(values, starts)
+    buckets['max'] = np.maximum.reduceat(values, starts)
+    buckets['mean'] = np.add.reduceat(values, starts)/counts
+    buckets['count'] = counts
+    return buckets
+
+
+def envelope(buckets, width):
+    """
+    Returns (times, values) drawing a vertical min-max segment at the center
+    of each bucket, so that no peak disappears from the plot.
+    """
+    times = np.repeat(buckets['time'] + width/2., 2)
+    values = np.empty(len(times))
+    values[::2] = buckets['min']
+    values[1::2] = buckets['max']
+    return times, values
+
+
+class PyramidLevel(object):
+    def __init__(self, width, filename):
+        self.width = width
+        self.file = ChannelFile(filename, dtype=BUCKET_DTYPE)
+        # bucket still receiving points: [time, min, max, mean, count]
+        self.current = None
+
+    def add(self, moment, val, writer):
+        start = (moment // self.width)*self.width
+        current = self.current
+        if current is not None and current[0] == start:
+            if val < current[1]:
+                current[1] = val
+            if val > current[2]:
+                current[2] = val
+            current[4] += 1
+            current[3] += (val - current[3])/current[4]
+        else:
+            if current is not None:
+                writer.append(self.file, *current)
+            self.current = [start, val, val, val, 1]
+
+    def feed(self, times, values):
+        """
+        Vectorized version of add for a chunk of sorted points. The completed
+        buckets are written directly to the file.
+        """
+        buckets = aggregate(times, values, self.width)
+        if not len(buckets):
+            return
+        current = self.current
+        if current is not None:
+            if current[0] == buckets[0]['time']:
+                first = buckets[0]
+                count = current[4] + first['count']
+                first['mean'] = (current[3]*current[4] +
+                                 first['mean']*first['count'])/count
+                first['min'] = min(current[1], first['min'])
+                first['max'] = max(current[2], first['max'])
+                first['count'] = count
+            else:
+                self.file.append(np.array([tuple(current)],
+                                          dtype=BUCKET_DTYPE))
+        self.file.append(buckets[:-1])
+        self.current = list(buckets[-1].item())
+
+    def buckets(self, t0=None, t1=None):
+        """
+        Returns the buckets overlapping [t0, t1], including the current one.
+        """
+        buckets = self.file.slice(None if t0 is None else t0 - self.width, t1)
+        current = self.current
+        if current is not None and (t1 is None or current[0] <= t1):
+            buckets = np.concatenate([buckets, np.array([tuple(current)],
+                                                        dtype=BUCKET_DTYPE)])
+        return buckets
+
+
+class Pyramid(object):
+    """
+    Downsampling pyramid of a channel storage, updated point by point with
+    add. The completed buckets go through the writer service like the raw
+    points. The raw points that are not yet summarized (all of them if the
+    pyramid doesn't exist) are aggregated chunk by chunk in a worker thread
+    (see catch_up_async): the pyramid is not ready before, and the points
+    added meanwhile are buffered. If the catch-up fails, error is set and the
+    reads fall back to the raw data until a new catch-up succeeds.
+    A readonly pyramid only reads the files as they are.
+    """
+    WIDTHS = (10., 60., 600., 3600.)
+
+    def __init__(self, storage, path, writer, readonly=False):
+        self.storage = storage
+        self.writer = writer
+        self.path = path
+        self.readonly = readonly
+        self.levels = self._create_levels()
+        self.ready = readonly
+        self.error = None # exception of the last failed catch-up
+        self._pending = [] # (moment, val) added during the catch-up
+        self._catching_up = None
+
+    def _create_levels(self):
+        if not osp.exists(self.path) and not self.readonly:
+            os.makedirs(self.path)
+        return [PyramidLevel(width, osp.join(self.path, '%is.pyr' % width))
+                for width in self.WIDTHS]
+
+    def catch_up(self, t1=None, chunk_size=2**20):
+        """
+        Aggregates the stored points older than t1 that are not summarized
+        yet. Blocking: to be called through catch_up_async.
+        """
+        starts = []
+        for level in self.levels:
+            level.current = None # rebuilt from the file (after a failure)
+            records = level.file.records
+            starts.append(records['time'][-1] + level.width if len(records)
+                          else -np.inf)
+        # one pass over the raw data for all the levels
+        for chunk in self.storage.iter_chunks(min(starts), chunk_size):
+            last = t1 is not None and chunk['time'][-1] >= t1
+            if last:
+                chunk = chunk[chunk['time'] < t1]
+            for level, t0 in zip(self.levels, starts):
+                part = chunk if len(chunk) and chunk['time'][0] >= t0 else \
+                    chunk[chunk['time'] >= t0]
+                level.feed(part['time'], part['value'])
+            if last:
+                break
+
+    def catch_up_async(self, executor):
+        """
+        Runs the catch-up in executor (once). Returns its future.
+        """
+        if self._catching_up is None:
+            # the points added from now on are buffered, and replayed after
+            self._catching_up = asyncio.get_event_loop().run_in_executor(
+                executor, self.catch_up, time.time())
+            self._catching_up.add_done_callback(self._caught_up)
+        return self._catching_up
+
+    def _caught_up(self, future):
+        self.error = future.exception()
+        if self.error is not None:
+            # not ready, the points stay buffered until the next attempt
+            print('%s: pyramid catch-up failed: %r' % (self.path, self.error))
+            self._catching_up = None
+            return
+        self.ready = True
+        pending, self._pending = self._pending, []
+        for moment, val in pending:
+            self.add(moment, val)
+
+    def add(self, moment, val):
+        if not self.ready:
+            self._pending.append((moment, val))
+            return
+        for level in self.levels:
+            level.add(moment, val, self.writer)
+
+    def flush(self):
+        for level in self.levels:
+            self.writer.flush(level.file)
+
+    def level_for(self, resolution):
+        """
+        Returns the coarsest level whose buckets are not wider than
+        resolution (None if the raw data are needed, or if the levels are
+        incomplete after a failed catch-up).
+        """
+        if self.error is not None:
+            return None
+        candidates = [level for level in self.levels
+                      if level.width <= resolution]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda level: level.width)
+
+    def read(self, t0=None, t1=None, resolution=0, flush=True):
+        """
+        Returns (times, values) to plot between t0 and t1 with about one
+        point per resolution seconds: the min/max envelope of the right
+        level, or the raw data for short windows.
+
+        With flush=False, the points pending in the writer are ignored, and
+        the method can be called from a worker thread.
+        """
+        level = self.level_for(resolution)
+        if level is None:
+            if flush:
+                self.writer.flush(self.storage)
+            return self.storage.read(t0, t1)
+        if flush:
+            self.writer.flush(level.file)
+        return envelope(level.buckets(t0, t1), level.width)
+
+    def first_time(self):
+        """
+        Time of the first stored point (None if there is none).
+        """
+        for chunk in self.storage.iter_chunks(chunk_size=1):
+            return chunk['time'][0]
+        return None
+
+    def tile(self, width, t0, t1):
+        """
+        Returns (times, values) between t0 (included) and t1 (excluded) of
+        the level of bucket width width (raw data if width is 0). Only
+        completed buckets are considered: this method doesn't touch the
+        state updated by add, and can be called from a worker thread.
+        """
+        if not width:
+            records = self.storage.slice(t0, t1)
+            records = records[records['time'] < t1]
+            return records['time'], records['value']
+        level = [level for level in self.levels if level.width == width][0]
+        buckets = level.file.slice(t0, t1)
+        return envelope(buckets[buckets['time'] < t1], width)
+
+    def move(self, path):
+        """
+        Renames the pyramid directory, keeping the current buckets.
+        """
+        for level in self.levels:
+            self.writer.release(level.file)
+        os.rename(self.path, path)
+        currents = [level.current for level in self.levels]
+        self.path = path
+        self.levels = self._create_levels()
+        for level, current in zip(self.levels, currents):
+            level.current = current
@@ -1,8 +1,7 @@
-from pyrpl import Pyrpl
-
-
 class RedpitayaChannel(object):
     def __init__(self, pyrpl_instance):
+        # the instance is created by the start script: importing pyrpl is
+        # left to it
         self.rp = pyrpl_instance.rp
 
     def in1(self):
@@ -0,0 +1,93 @@
+import numpy as np
+
+from .pyramid import aggregate, envelope
+
+
+class RingBuffer(object):
+    """
+    Growable buffer of (time, value) points with amortized O(1) append at
+    the end and eviction at the beginning.
+
+    The live points are kept contiguous (they are moved back to the
+    beginning of the arrays when the end is reached), so that times and
+    values are plain array views that can be handed to pyqtgraph as is.
+    """
+
+    def __init__(self, capacity=1024):
+        self._times = np.empty(capacity)
+        self._values = np.empty(capacity)
+        self._start = 0
+        self._stop = 0
+
+    def __len__(self):
+        return self._stop - self._start
+
+    @property
+    def times(self):
+        return self._times[self._start:self._stop]
+
+    @property
+    def values(self):
+        return self._values[self._start:self._stop]
+
+    def append(self, moment, val):
+        if self._stop == len(self._times):
+            self._make_room(1)
+        self._times[self._stop] = moment
+        self._values[self._stop] = val
+        self._stop += 1
+
+    def extend(self, times, values):
+        n = len(times)
+        if self._stop + n > len(self._times):
+            self._make_room(n)
+        self._times[self._stop:self._stop + n] = times
+        self._values[self._stop:self._stop + n] = values
+        self._stop += n
+
+    def _make_room(self, n):
+        """
+        Moves the live points to the beginning of the arrays, reallocating
+        them twice as large if they would be more than half full.
+        """
+        n_live = len(self)
+        capacity = len(self._times)
+        while 2*(n_live + n) > capacity:
+            capacity *= 2
+        if capacity == len(self._times):
+            times, values = self._times, self._values
+        else:
+            times, values = np.empty(capacity), np.empty(capacity)
+        times[:n_live] = self.times
+        values[:n_live] = self.values
+        self._times, self._values = times, values
+        self._start, self._stop = 0, n_live
+
+    def evict_before(self, moment):
+        """
+        Drops the points older than moment (times are assumed sorted).
+        """
+        self._start += int(np.searchsorted(self.times, moment, side='left'))
+
+    def decimate(self, width):
+        """
+        Replaces the points by the min/max envelope of buckets of width
+        seconds, except those of the last bucket, still growing. Points that
+        are already an envelope at this width are left unchanged.
+        """
+        times = self.times
+        if not len(times):
+            return
+        stop = int(np.searchsorted(times, (times[-1] // width)*width,
+                                   side='left'))
+        buckets = aggregate(times[:stop], self.values[:stop], width)
+        env_times, env_values = envelope(buckets, width)
+        self.set(np.concatenate([env_times, times[stop:]]),
+                 np.concatenate([env_values, self.values[stop:]]))
+
+    def set(self, times, values):
+        """
+        Replaces the content of the buffer.
+        """
+        self._start = self._stop = 0
+        self.extend(times, values)
@@ -8,12 +8,14 @@ sys.path.append(dir_path) # In case datalogger not
 
 if __name__=='__main__':
     directory = sys.argv[1]
-
+    # --readonly: only displays the data of a DataLogger running elsewhere
+    # (e.g. run_headless.py)
+    readonly = '--readonly' in sys.argv[2:]
 
     APP = QtWidgets.QApplication(sys.argv)
 
     from datalogger import DataLogger
 
-    DLG = DataLogger(directory)
+    DLG = DataLogger(directory, readonly=readonly)
 
     APP.exec_()
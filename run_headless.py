@@ -0,0 +1,41 @@
+"""
+Runs a DataLogger without GUI (no Qt import), e.g. on an acquisition box:
+    python run_headless.py DIRECTORY
+
+The data can be watched from another machine/process with:
+    python run.py DIRECTORY --readonly
+"""
+import sys
+import signal
+import asyncio
+import os.path as osp
+dir_path = osp.split(osp.dirname(osp.realpath(__file__)))[0]
+sys.path.append(dir_path) # In case datalogger not
+# accessible in normal PYTHONPATH
+
+
+if __name__=='__main__':
+    directory = sys.argv[1]
+
+    LOOP = asyncio.new_event_loop()
+    asyncio.set_event_loop(LOOP)
+
+    from datalogger import DataLogger
+
+    DLG = DataLogger(directory, gui=False)
+
+    for sig in signal.SIGINT, signal.SIGTERM:
+        try:
+            LOOP.add_signal_handler(sig, LOOP.stop)
+        except (NotImplementedError, AttributeError): # Windows
+            pass
+    # kill -USR1 <pid> dumps the telemetry in DIRECTORY/telemetry.json
+    if hasattr(signal, 'SIGUSR1'):
+        LOOP.add_signal_handler(signal.SIGUSR1, DLG.dump_telemetry,
+                                osp.join(directory, 'telemetry.json'))
+    try:
+        LOOP.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        DLG.close()
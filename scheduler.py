@@ -0,0 +1,193 @@
+"""
+Central acquisition scheduler.
+
+All the active channels of a DataLogger are sampled from a single priority
+queue of deadlines on the monotonic clock, at a fixed rate (the delay of
+the channel is the period, whatever the duration of the measurement).
+Deadlines are aligned on multiples of the period in absolute time, so that
+channels with the same delay are sampled together (which also lets the
+instruments merge their queries, see serial_interface.BatchedQuery).
+"""
+import asyncio
+import collections
+import heapq
+import itertools
+import math
+import time
+
+SKIP = 'skip' # missed deadlines are dropped
+CATCH_UP = 'catch_up' # missed deadlines are executed as soon as possible
+# (one after the other, when the running sample of the channel returns)
+
+
+class JitterStats(object):
+    """
+    Lateness of the sample starts with respect to their deadlines, and
+    effective sampling period of a channel.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self._m2 = 0.
+        self.max = 0.
+        self.overruns = 0 # deadline reached while the previous sample runs
+        self.skipped = 0 # deadlines dropped (SKIP, or CATCH_UP backlog full)
+        self.caught_up = 0 # missed deadlines executed late by CATCH_UP
+        self.period = None # average time between sample starts
+        self._last_start = None
+
+    def add(self, lateness, start):
+        self.n += 1
+        delta = lateness - self.mean
+        self.mean += delta/self.n
+        self._m2 += delta*(lateness - self.mean)
+        self.max = max(self.max, lateness)
+        if self._last_start is not None:
+            period = start - self._last_start
+            self.period = period if self.period is None else \
+                0.9*self.period + 0.1*period
+        self._last_start = start
+
+    @property
+    def std(self):
+        return math.sqrt(self._m2/self.n) if self.n > 1 else 0.
+
+    def as_dict(self):
+        return dict(n=self.n, mean=self.mean, std=self.std, max=self.max,
+                    overruns=self.overruns, skipped=self.skipped,
+                    caught_up=self.caught_up, period=self.period)
+
+
+class Scheduler(object):
+    """
+    Calls the coroutine channel.measure() every channel.delay seconds for
+    all the channels added. overrun is the policy for deadlines that could
+    not be met (SKIP or CATCH_UP).
+    """
+    MIN_PERIOD = 1e-3
+    MAX_BACKLOG = 100 # missed deadlines kept per channel by CATCH_UP
+
+    def __init__(self, overrun=SKIP):
+        self.overrun = overrun
+        self.stats = dict() # channel -> JitterStats
+        self._heap = [] # (deadline, index, channel, token)
+        self._tokens = dict() # channel -> token of its valid heap entry
+        self._running = dict() # channel -> task of the current sample
+        self._backlog = dict() # channel -> deque of missed deadlines
+        self._index = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # monotonic time -> absolute time, for the phase alignment
+        self._offset = time.time() - time.monotonic()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def period(self, channel):
+        return max(float(channel.delay), self.MIN_PERIOD)
+
+    def _push(self, channel, deadline):
+        token = object()
+        self._tokens[channel] = token
+        heapq.heappush(self._heap, (deadline, next(self._index), channel,
+                                    token))
+
+    def add(self, channel):
+        """
+        Starts sampling channel at the next multiple of its period.
+        """
+        period = self.period(channel)
+        now = time.monotonic() + self._offset
+        deadline = math.ceil(now/period)*period - self._offset
+        self.stats.setdefault(channel, JitterStats())
+        self._push(channel, deadline)
+        self._wakeup.set()
+
+    def remove(self, channel):
+        self._tokens.pop(channel, None)
+        self._backlog.pop(channel, None)
+
+    def reschedule(self, channel):
+        """
+        To be called when the period of channel changes.
+        """
+        if channel in self._tokens:
+            self.add(channel)
+
+    async def run(self):
+        while True:
+            if not self._heap:
+                await self._wait(None)
+                continue
+            deadline, index, channel, token = self._heap[0]
+            if self._tokens.get(channel) is not token: # removed/rescheduled
+                heapq.heappop(self._heap)
+                continue
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await self._wait(delay) # or an earlier deadline is added
+                continue
+            heapq.heappop(self._heap)
+            self._fire(channel, deadline)
+            if self.overrun == CATCH_UP:
+                await asyncio.sleep(0) # lets the samples start in turn
+
+    async def _wait(self, delay):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _fire(self, channel, deadline):
+        now = time.monotonic()
+        stats = self.stats[channel]
+        task = self._running.get(channel)
+        if task is not None and not task.done():
+            stats.overruns += 1
+            if self.overrun == CATCH_UP:
+                backlog = self._backlog.setdefault(channel,
+                                                   collections.deque())
+                if len(backlog) < self.MAX_BACKLOG:
+                    backlog.append(deadline) # run when the sample returns
+                else:
+                    stats.skipped += 1
+        else:
+            self._start(channel, deadline)
+        period = self.period(channel)
+        deadline += period
+        if deadline <= now and self.overrun == SKIP:
+            missed = math.ceil((now - deadline)/period)
+            if deadline + missed*period <= now:
+                missed += 1
+            stats.skipped += missed
+            deadline += missed*period
+        self._push(channel, deadline)
+
+    def _start(self, channel, deadline):
+        now = time.monotonic()
+        self.stats[channel].add(now - deadline, now)
+        task = self._running[channel] = asyncio.ensure_future(
+            channel.measure())
+        task.add_done_callback(lambda task: self._sample_done(channel))
+
+    def _sample_done(self, channel):
+        backlog = self._backlog.get(channel)
+        if not backlog or self._tokens.get(channel) is None: # removed
+            return
+        self.stats[channel].caught_up += 1
+        self._start(channel, backlog.popleft())
+
+    def jitter_report(self):
+        """
+        Returns {channel name: jitter statistics}.
+        """
+        return dict((channel.name, stats.as_dict())
+                    for channel, stats in self.stats.items())
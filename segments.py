@@ -0,0 +1,279 @@
+"""
+Segmented storage of the channel data.
+
+Instead of a single ever-growing <name>.chan file, the data of a channel
+are rolled into segment files (in the .chan format) inside a directory
+<name>.segments. A new segment is started every "period" seconds (UTC day
+boundaries by default) and/or when the current segment reaches "max_bytes".
+The manifest.json of the directory records the time span and the number of
+records of each segment, so that a query only opens the segments
+overlapping it.
+
+Existing monolithic files can be split with:
+    python -m datalogger.segments DIRECTORY [--period-days 1] [--max-mb N]
+"""
+import os
+import os.path as osp
+import json
+import time
+import argparse
+import numpy as np
+
+from .storage import ChannelFile, RECORD_DTYPE, empty_records
+
+SEGMENTS_SUFFIX = '.segments'
+DAY = 24*3600.
+
+
+class SegmentedChannelFile(object):
+    """
+    Same interface as storage.ChannelFile, for a directory of segments.
+
+    A readonly instance (viewer of the data written by another process)
+    never writes the manifest, and reloads it when it is modified.
+    """
+    MANIFEST = 'manifest.json'
+    dtype = RECORD_DTYPE
+
+    def __init__(self, path, period=DAY, max_bytes=None, readonly=False):
+        self.path = path
+        self.period = period
+        self.max_bytes = max_bytes
+        self.readonly = readonly
+        self._segments = None # loaded from the manifest on first use
+        self._manifest_mtime = None
+        self._files = dict()
+
+    @property
+    def manifest_file(self):
+        return osp.join(self.path, self.MANIFEST)
+
+    def exists(self):
+        return osp.isdir(self.path)
+
+    def create(self):
+        if not osp.exists(self.path):
+            os.makedirs(self.path)
+        if not osp.exists(self.manifest_file):
+            self._write_manifest()
+
+    @property
+    def segments(self):
+        """
+        List of dicts {'file', 't0', 't1', 'n'} in chronological order.
+        """
+        if self._segments is None or (self.readonly and
+                                      self._mtime() != self._manifest_mtime):
+            self._load_manifest()
+        return self._segments
+
+    def _mtime(self):
+        try:
+            return os.stat(self.manifest_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_manifest(self):
+        self._segments = []
+        self._manifest_mtime = self._mtime()
+        if self._manifest_mtime is None:
+            return
+        with open(self.manifest_file, 'r') as f:
+            manifest = json.load(f)
+        self.period = manifest.get('period', self.period)
+        self.max_bytes = manifest.get('max_bytes', self.max_bytes)
+        self._segments = manifest['segments']
+        # the manifest is only written when segments are created or closed:
+        # the last segment may have grown since.
+        if self._segments:
+            self._refresh(self._segments[-1])
+
+    def _refresh(self, segment):
+        records = self._file(segment).records
+        segment['n'] = len(records)
+        if len(records):
+            segment['t0'] = float(records['time'][0])
+            segment['t1'] = float(records['time'][-1])
+
+    def _write_manifest(self):
+        manifest = dict(period=self.period,
+                        max_bytes=self.max_bytes,
+                        segments=self.segments)
+        tmp = self.manifest_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_file)
+
+    def _file(self, segment):
+        name = segment['file']
+        if name not in self._files:
+            self._files[name] = ChannelFile(osp.join(self.path, name))
+        return self._files[name]
+
+    def last_time(self):
+        for segment in reversed(self.segments):
+            last = self._file(segment).last_time()
+            if last is not None:
+                return last
+        return None
+
+    @property
+    def n_records(self):
+        return sum(seg['n'] for seg in self.segments)
+
+    def _key(self, moment):
+        return int(moment // self.period)
+
+    def _capacity(self):
+        return max(1, int(self.max_bytes) // RECORD_DTYPE.itemsize)
+
+    def _accepts(self, segment, moment):
+        if self.period and self._key(segment['t0']) != self._key(moment):
+            return False
+        if self.max_bytes and segment['n'] >= self._capacity():
+            return False
+        return True
+
+    def _new_segment(self, moment):
+        if self.segments: # the previous segment won't be appended anymore
+            self._file(self.segments[-1]).close()
+        name = time.strftime('%Y%m%d_%H%M%S', time.gmtime(moment))
+        existing = set(seg['file'] for seg in self.segments)
+        filename = name + '.chan'
+        index = 0
+        while filename in existing:
+            index += 1
+            filename = '%s_%i.chan' % (name, index)
+        segment = dict(file=filename, t0=float(moment), t1=float(moment), n=0)
+        self.segments.append(segment)
+        self.create()
+        self._write_manifest()
+        return segment
+
+    def append(self, records):
+        """
+        Appends an array of RECORD_DTYPE, starting new segments as needed.
+        """
+        while len(records):
+            times = records['time']
+            segment = self.segments[-1] if self.segments else None
+            if segment is None or not self._accepts(segment, times[0]):
+                segment = self._new_segment(times[0])
+            n = len(records)
+            if self.period:
+                end = (self._key(segment['t0']) + 1)*self.period
+                n = int(np.searchsorted(times, end, side='left'))
+            if self.max_bytes:
+                n = min(n, self._capacity() - segment['n'])
+            n = max(n, 1)
+            self._file(segment).append(records[:n])
+            segment['n'] += n
+            segment['t1'] = float(times[n - 1])
+            records = records[n:]
+
+    def sync(self):
+        if self.segments:
+            self._file(self.segments[-1]).sync()
+            self._write_manifest()
+
+    def close(self):
+        if self._segments is not None and osp.isdir(self.path) and \
+                not self.readonly:
+            self._write_manifest()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def _overlapping(self, t0, t1):
+        segments = self.segments
+        for index, segment in enumerate(segments):
+            last = index == len(segments) - 1 # may grow beyond its t1
+            if t1 is not None and segment['t0'] > t1:
+                continue
+            if t0 is not None and segment['t1'] < t0 and not last:
+                continue
+            yield segment
+
+    def slice(self, t0=None, t1=None):
+        """
+        Returns the records with t0 <= time <= t1 (None means unbounded).
+        Only the segments overlapping the interval are opened. The result is
+        a view if the interval falls within a single segment.
+        """
+        parts = [self._file(segment).slice(t0, t1)
+                 for segment in self._overlapping(t0, t1)]
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return empty_records()
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def read(self, t0=None, t1=None):
+        records = self.slice(t0, t1)
+        return records['time'], records['value']
+
+    def iter_chunks(self, t0=None, chunk_size=2**20):
+        """
+        Yields the records with time >= t0 segment by segment, in arrays of
+        at most chunk_size records.
+        """
+        for segment in self._overlapping(t0, None):
+            for chunk in self._file(segment).iter_chunks(t0, chunk_size):
+                yield chunk
+
+
+def migrate(filename, path, period=DAY, max_bytes=None, chunk_size=2**20):
+    """
+    Splits the monolithic .chan file filename into a segment directory
+    path. The source is memory-mapped and copied chunk by chunk, so it is
+    never loaded fully into memory.
+    """
+    source = ChannelFile(filename)
+    target = SegmentedChannelFile(path, period=period, max_bytes=max_bytes)
+    target.create()
+    for chunk in source.iter_chunks(chunk_size=chunk_size):
+        target.append(chunk)
+    target.close()
+    source.close()
+    return target
+
+
+def migrate_directory(directory, period=DAY, max_bytes=None,
+                      remove_original=False):
+    """
+    Migrates all the .chan files of a datalogger directory. The original
+    files are kept as <name>.chan.bak unless remove_original is True.
+    """
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.chan'):
+            continue
+        source = osp.join(directory, filename)
+        path = osp.join(directory, filename[:-len('.chan')] + SEGMENTS_SUFFIX)
+        if osp.exists(path):
+            print('skipping %s: %s already exists' % (filename, path))
+            continue
+        target = migrate(source, path, period=period, max_bytes=max_bytes)
+        print('%s: %i records in %i segments' % (filename, target.n_records,
+                                                 len(target.segments)))
+        if remove_original:
+            os.remove(source)
+        else:
+            os.rename(source, source + '.bak')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Splits the .chan files of a datalogger directory into '
+                    'time-partitioned segments')
+    parser.add_argument('directory')
+    parser.add_argument('--period-days', type=float, default=1.,
+                        help='segment duration in days (0: no time split)')
+    parser.add_argument('--max-mb', type=float, default=None,
+                        help='maximum segment size in MB')
+    parser.add_argument('--remove-original', action='store_true')
+    args = parser.parse_args()
+    migrate_directory(args.directory,
+                      period=args.period_days*DAY or None,
+                      max_bytes=args.max_mb and int(args.max_mb*2**20),
+                      remove_original=args.remove_original)
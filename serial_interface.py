@@ -3,11 +3,16 @@ import socket
 import sys
 from asyncio import Future, ensure_future, CancelledError, \
     set_event_loop, TimeoutError
-import quamash
 import asyncio
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 from serial import SerialException
 
+from .breaker import CircuitBreaker, CircuitOpenError
+from . import telemetry
+
 
 
 def serial_interface_factory(ip_or_port, **kwds):
@@ -16,29 +21,232 @@ def serial_interface_factory(ip_or_port, **kwds):
     kwds are the extra parameters for the Serial object (unfortunately, have
     to be set manually in the wiznet for an ethernet connection).
     """
-    if ip_or_port.find("COM") >= 0:  # serial port
+    if ip_or_port.find("COM") >= 0 or ip_or_port.startswith('/dev/'):
+        # serial port
         return SerialConnection(ip_or_port, **kwds)
     else:
         return Wiznet(ip_or_port)
 
 
+PRIORITY_INTERACTIVE = 0 # commands issued by the user
+PRIORITY_POLL = 10 # periodic measurements
+
+
+class CommandQueue(object):
+    """
+    Serializes the transactions on a port.
+
+    Transactions are executed one at a time, by order of priority (lowest
+    first), then of submission. To stay fair, the priority of a waiting
+    transaction is raised by one every AGING seconds, so that polls are
+    never starved by a stream of interactive commands.
+    """
+    AGING = 1. # s
+
+    def __init__(self, name):
+        self.name = name
+        self._pending = [] # [priority, index, submission time, func, future]
+        self._index = 0
+        self._worker = None
+        self.busy = False
+        self.n_done = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+    @property
+    def depth(self):
+        """
+        Number of transactions waiting or in progress.
+        """
+        return len(self._pending) + self.busy
+
+    @property
+    def stats(self):
+        return dict(depth=self.depth,
+                    n_done=self.n_done,
+                    mean_wait=self.total_wait/self.n_done if self.n_done
+                    else 0.,
+                    max_wait=self.max_wait)
+
+    async def submit(self, func, priority=PRIORITY_POLL):
+        """
+        Returns the result of the coroutine function func, called when its
+        turn comes.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append([priority, self._index, time.monotonic(), func,
+                              future])
+        self._index += 1
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._run())
+        return await future
+
+    def _next(self):
+        now = time.monotonic()
+        entry = min(self._pending,
+                    key=lambda e: (e[0] - (now - e[2])/self.AGING, e[1]))
+        self._pending.remove(entry)
+        return entry
+
+    async def _run(self):
+        try:
+            while self._pending:
+                priority, index, submitted, func, future = self._next()
+                if future.done(): # the caller gave up
+                    continue
+                wait = time.monotonic() - submitted
+                self.n_done += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.busy = True
+                try:
+                    result = await func()
+                except CancelledError: # the worker is cancelled (shutdown)
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self.busy = False
+        finally:
+            self._worker = None
+
+
+async def guarded_transaction(conn, retry, n_retries, priority):
+    """
+    Submits retry(n_retries) to the queue of conn (a SerialPort or a
+    WiznetConnection) through its circuit breaker: a port that keeps
+    failing is only probed from time to time, with a single attempt.
+    """
+    if not conn.breaker.allow():
+        raise CircuitOpenError('%s: %s' % (conn.queue.name, conn.breaker))
+    if conn.breaker.failures:
+        n_retries = 1
+    start = time.perf_counter()
+    try:
+        result = await conn.queue.submit(partial(retry, n_retries), priority)
+    except BaseException as e:
+        # includes the cancellations (e.g. caller's wait_for): a probe
+        # whose outcome is unknown must not leave the breaker half-open
+        conn.breaker.failure(repr(e))
+        raise
+    telemetry.record('transaction', conn.queue.name,
+                     time.perf_counter() - start)
+    conn.breaker.success()
+    return result
+
+
+def queue_stats():
+    """
+    Returns {port: stats} for all the serial ports and Wiznets in use.
+    """
+    stats = dict()
+    for cls in SerialPort, WiznetConnection:
+        for conn in cls._pool.values():
+            stats[conn.queue.name] = dict(conn.queue.stats,
+                                          breaker=str(conn.breaker))
+    return stats
+
+
 class SerialInterface(object):
     """
     Asynchronous serial interface.
     Exposes an asynchronous coroutine "ask".
+    The transactions are serialized by the CommandQueue "queue" of the
+    port: ask defaults to PRIORITY_POLL, write to PRIORITY_INTERACTIVE.
     """
     N_RETRIES = 1
     linebreak = '\n'
 
-    async def ask(self, val):
+    async def ask(self, val, timeout=None, priority=PRIORITY_POLL):
         raise NotImplementedError("To implement in a derived class")
 
+    async def write(self, val, timeout=None, priority=PRIORITY_INTERACTIVE):
+        raise NotImplementedError("To implement in a derived class")
+
+
+class SerialPort(object):
+    """
+    Long-lived pyserial handle of a COM port, shared by all the
+    SerialConnections on the same port (see get). The handle is only used
+    from a dedicated I/O thread, so that blocking reads never stall the
+    event loop. It is opened on first use and re-opened after any failure.
+    """
+    _pool = dict()
+
+    @classmethod
+    def get(cls, port):
+        if port not in cls._pool:
+            cls._pool[port] = cls(port)
+        return cls._pool[port]
+
+    def __init__(self, port):
+        self.port = port
+        self.serial = None
+        self.executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix=port)
+        self.queue = CommandQueue(port)
+        self.breaker = CircuitBreaker()
+
+    def close(self):
+        if self.serial is not None:
+            self.serial.close()
+        self.serial = None
+
+    def _transaction(self, conn_kwds, val, linebreak, reply, timeout):
+        """
+        Blocking transaction, executed in the I/O thread.
+        """
+        try:
+            if self.serial is None:
+                self.serial = Serial(**conn_kwds)
+            self.serial.timeout = timeout
+            self.serial.write_timeout = timeout
+            self.serial.reset_input_buffer() # leftovers of previous replies
+            self.serial.write((val + linebreak).encode())
+            if not reply:
+                return
+            end = '\n' if '\n' in linebreak else linebreak
+            line = self.serial.read_until(end.encode())
+            if not line.endswith(end.encode()):
+                raise TimeoutError("no reply to %s within %s s" % (val,
+                                                                    timeout))
+            return line.decode().rstrip(linebreak)
+        except BaseException:
+            self.close()
+            raise
+
+    async def transaction(self, conn_kwds, val, linebreak, reply=True,
+                          n_retries=1, timeout=2., priority=PRIORITY_POLL):
+        return await guarded_transaction(
+            self, partial(self._retry, conn_kwds, val, linebreak, reply,
+                          timeout), n_retries, priority)
+
+    async def _retry(self, conn_kwds, val, linebreak, reply, timeout,
+                     n_retries):
+        loop = asyncio.get_event_loop()
+        for retry in range(n_retries):
+            try:
+                return await loop.run_in_executor(
+                    self.executor, self._transaction, conn_kwds, val,
+                    linebreak, reply, timeout)
+            except TimeoutError: # left to the circuit breaker: retrying
+                raise # would hold the port for n_retries timeouts
+            except (SerialException, OSError) as e: # reconnects
+                continue
+        raise ValueError("Failed to connect after %i retries" % n_retries)
+
 
 class SerialConnection(SerialInterface):
     """
     a serial object includes a function "ask".
     The linebreak attribute has to be set properly for ask to work.
-    The serial port is closed outside calls of function 'ask'
+    The serial port stays open between calls, in the I/O thread of its
+    SerialPort.
     """
 
     baudrate = 9600
@@ -46,6 +254,8 @@ class SerialConnection(SerialInterface):
     parity = 'O'
     stopbits = 1
     timeout = None
+    DEFAULT_TIMEOUT = 5. # s, used if neither timeout nor the per-call
+    # timeout are set: a silent instrument shouldn't block its port forever
     xonxoff = False
     rtscts = False
     dsrdtr = False
@@ -53,6 +263,10 @@ class SerialConnection(SerialInterface):
     def __init__(self, port):
         self.port = port
 
+    @property
+    def serial_port(self):
+        return SerialPort.get(self.port)
+
     @property
     def conn_kwds(self):
         return dict(port=self.port, baudrate=self.baudrate,
@@ -61,103 +275,186 @@ class SerialConnection(SerialInterface):
                     xonxoff=self.xonxoff, rtscts=self.rtscts,
                     dsrdtr=self.dsrdtr)
 
-    async def write(self, val):
-        for retry in range(self.N_RETRIES):
-            try:
-                with Serial(**self.conn_kwds) as ser:
-                    ser.write((val + self.linebreak).encode())
-                    return
-            except SerialException as e:
-                continue
-        raise ValueError("Failed to connect after %i retries" % self.N_RETRIES)
+    def _timeout(self, timeout):
+        for val in timeout, self.timeout, self.DEFAULT_TIMEOUT:
+            if val is not None:
+                return val
+
+    @property
+    def queue(self):
+        return self.serial_port.queue
+
+    async def write(self, val, timeout=None, priority=PRIORITY_INTERACTIVE):
+        await self.serial_port.transaction(self.conn_kwds, val,
+                                           self.linebreak, reply=False,
+                                           n_retries=self.N_RETRIES,
+                                           timeout=self._timeout(timeout),
+                                           priority=priority)
+
+    async def ask(self, val, timeout=None, priority=PRIORITY_POLL):
+        return await self.serial_port.transaction(
+            self.conn_kwds, val, self.linebreak, n_retries=self.N_RETRIES,
+            timeout=self._timeout(timeout), priority=priority)
 
-    async def ask(self, val):
-        for retry in range(self.N_RETRIES):
+
+class WiznetConnection(object):
+    """
+    Persistent TCP connection to a Wiznet, shared by all the Wiznet
+    interfaces with the same (ip, port) (see get). The connection is opened
+    on first use and re-opened after any failure.
+    """
+    _pool = dict()
+
+    @classmethod
+    def get(cls, ip, port):
+        key = (ip, port)
+        if key not in cls._pool:
+            cls._pool[key] = cls(ip, port)
+        return cls._pool[key]
+
+    def __init__(self, ip, port):
+        self.ip = ip
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.queue = CommandQueue('%s:%i' % (ip, port))
+        self.breaker = CircuitBreaker()
+
+    async def connect(self, connect_delay, timeout):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.ip, self.port), timeout)
+        await asyncio.sleep(connect_delay) # (even with a succesful
+        # connect, a delay seems to be needed by the wiznet)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def transaction(self, val, linebreak, reply=True, n_retries=1,
+                          connect_delay=0.1, timeout=2.,
+                          priority=PRIORITY_POLL):
+        """
+        Sends val + linebreak, and if reply is True, returns the next line
+        received (without linebreak), waiting at most timeout.
+        """
+        return await guarded_transaction(
+            self, partial(self._retry, val, linebreak, reply, connect_delay,
+                          timeout), n_retries, priority)
+
+    async def _retry(self, val, linebreak, reply, connect_delay, timeout,
+                     n_retries):
+        for retry in range(n_retries):
             try:
-                with Serial(**self.conn_kwds) as ser:
-                    ser.write((val + self.linebreak).encode())
-                    return ser.readline().decode().rstrip(self.linebreak)
-            except SerialException as e:
+                if self.writer is None:
+                    await self.connect(connect_delay, timeout)
+                self.writer.write((val + linebreak).encode('utf-8'))
+                await self.writer.drain()
+                if not reply:
+                    return
+                line = await asyncio.wait_for(
+                    self.reader.readuntil(linebreak.encode('utf-8')),
+                    timeout)
+                return line.decode()[:-len(linebreak)]
+            except TimeoutError:
+                # the reply may still come later: start from a fresh
+                # connection to keep requests and replies in sync. Not
+                # retried, repeated timeouts are left to the circuit breaker
+                self.close()
+                raise
+            except (OSError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError) as e:
+                # connection lost, or garbled/overlong reply: reconnects
+                self.close()
                 continue
-        raise ValueError("Failed to connect after %i retries" % self.N_RETRIES)
+        raise ValueError("Failed to connect after %i retries" % n_retries)
 
 
 class Wiznet(SerialInterface):
     """
     a serial interface includes a function "ask"
+
+    All Wiznet objects with the same ip share a persistent connection.
     """
     CONNECT_DELAY = 0.1
-    #SEND_DELAY = 0.1
-    #CLOSE_DELAY = 0.1
+    TIMEOUT = 2. # s, maximum time to wait for a reply
     PORT = 5000
 
     def __init__(self, ip):
         self.ip = ip
 
-    async def write(self, val):
-        for retry in range(self.N_RETRIES):
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.setblocking(0) # connect, send, and receive should return
-            # or fail immediately
-            try:
-                conn.connect((self.ip, self.PORT))
-            except BlockingIOError as e: # always fails to connect instantly
-                pass
-            await asyncio.sleep(self.CONNECT_DELAY) # (even with a succesful
-            # blocking connect, a delay seems to be needed by the wiznet
-            string = (val + self.linebreak).encode('utf-8')
-            try:
-                conn.send(string)
-                return
-            except OSError as e: # send failed because connection is not
-                # available
-                continue # continue with the retry loop
-            finally: # In any case, the connection should be closed
-                try:
-                    conn.shutdown(socket.SHUT_WR) # closes quickly
-                except OSError as e:  # socket already disconnected
-                    pass
-                finally:
-                    await asyncio.sleep(self.CLOSE_DELAY)
-                    conn.close()
-        raise ValueError("Failed to connect after %i retries"%self.N_RETRIES)
-
-    async def ask(self, val):
-        for retry in range(self.N_RETRIES):
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.setblocking(0) # connect, send, and receive should return
-            # or fail immediately
-            try:
-                conn.connect((self.ip, self.PORT))
-            except BlockingIOError as e: # always fails to connect instantly
-                pass
-            await asyncio.sleep(self.CONNECT_DELAY) # (even with a succesful
-            # blocking connect, a delay seems to be needed by the wiznet
-            try:
-                conn.recv(1024)  # Make sure the buffer is empty
-            except OSError as e:
-                pass
-            await asyncio.sleep(self.CONNECT_DELAY)
-            string = (val + self.linebreak).encode('utf-8')
-            try:
-                conn.send(string)
-                await asyncio.sleep(self.CONNECT_DELAY)
-                result = conn.recv(1024)
-                result = result.decode()
-                assert result.endswith(self.linebreak) # to make sure all data have been received
-                return result.rstrip(self.linebreak)
-            except OSError as e: # send failed because connection is not
-                # available
-                continue # continue with the retry loop
-            finally: # In any case, the connection should be closed
-                try:
-                    conn.shutdown(socket.SHUT_WR) # closes quickly
-                except OSError as e:  # socket already disconnected
-                    pass
-                finally:
-                    await asyncio.sleep(self.CONNECT_DELAY)
-                    conn.close()
-        raise ValueError("Failed to connect after %i retries"%self.N_RETRIES)
+    @property
+    def connection(self):
+        return WiznetConnection.get(self.ip, self.PORT)
+
+    @property
+    def queue(self):
+        return self.connection.queue
+
+    async def write(self, val, timeout=None, priority=PRIORITY_INTERACTIVE):
+        await self.connection.transaction(val, self.linebreak, reply=False,
+                                          n_retries=self.N_RETRIES,
+                                          connect_delay=self.CONNECT_DELAY,
+                                          timeout=timeout or self.TIMEOUT,
+                                          priority=priority)
+
+    async def ask(self, val, timeout=None, priority=PRIORITY_POLL):
+        return await self.connection.transaction(
+            val, self.linebreak, n_retries=self.N_RETRIES,
+            connect_delay=self.CONNECT_DELAY, timeout=timeout or self.TIMEOUT,
+            priority=priority)
+
+
+class BatchedQuery(object):
+    """
+    Merges the queries asked during the same scheduling tick (i.e. before the
+    event loop gets back to its ready callbacks) into a single compound
+    query "Q1;Q2;...", for instruments replying "R1;R2;...". Each caller
+    gets its own part of the reply. Identical queries are only sent once.
+    """
+    MAX_QUERIES = 8 # per transaction (input buffers of the instruments
+    # are short)
+
+    def __init__(self, serial, separator=';'):
+        self.serial = serial
+        self.separator = separator
+        self._pending = [] # (query, future)
+        self._handle = None
+
+    async def ask(self, query):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((query, future))
+        if self._handle is None:
+            self._handle = loop.call_soon(self._send)
+        return await future
+
+    def _send(self):
+        self._handle = None
+        pending, self._pending = self._pending, []
+        queries = list(dict.fromkeys(query for query, future in pending))
+        for start in range(0, len(queries), self.MAX_QUERIES):
+            chunk = queries[start:start + self.MAX_QUERIES]
+            futures = [(query, future) for query, future in pending
+                       if query in chunk]
+            ensure_future(self._ask(chunk, futures))
+
+    async def _ask(self, queries, futures):
+        try:
+            reply = await self.serial.ask(self.separator.join(queries))
+            answers = reply.split(self.separator)
+            if len(answers) != len(queries):
+                raise ValueError("%i replies to %i queries: %s" % (
+                    len(answers), len(queries), reply))
+        except BaseException as e:
+            for query, future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            results = dict(zip(queries, answers))
+            for query, future in futures:
+                if not future.done():
+                    future.set_result(results[query].strip())
 
 
 class SerialInstrument(object):
@@ -166,9 +463,14 @@ class SerialInstrument(object):
     an instance member "serial" with the right interface depending on
     ip_or_port (COM1--> SerialInterface, '10.214.1.85'--> Wiznet) is
     created. The remaining kwds are used for the SerialInterface constructor.
+
+    There is a single instance per class and address: when the start script
+    is run again, SerialInstrument(ip_or_port) returns the live instrument
+    (with its connection and batch of queries) instead of a new one.
     """
+    _sessions = dict() # (class, ip_or_port) -> instance
     CONNECT_DELAY = 0.1
-    N_RETRIES = 10
+    N_RETRIES = 2 # i.e. one reconnection (timeouts are not retried)
     baudrate = 9600
     bytesize = 8
     parity = 'O'
@@ -178,8 +480,21 @@ class SerialInstrument(object):
     rtscts = False
     dsrdtr = False
     linebreak = '\n'
+    BATCH_QUERIES = False # if the instrument accepts compound queries
+    QUERY_SEPARATOR = ';'
+
+    def __new__(cls, ip_or_port='COM1', **kwds):
+        key = (cls, ip_or_port)
+        if key not in cls._sessions:
+            instance = super(SerialInstrument, cls).__new__(cls)
+            instance._session_open = False
+            cls._sessions[key] = instance
+        return cls._sessions[key]
 
     def __init__(self, ip_or_port='COM1', **kwds):
+        if self._session_open: # reused session
+            return
+        self._session_open = True
         self.serial = serial_interface_factory(ip_or_port, **kwds)
         self.serial.linebreak = self.linebreak
         self.serial.CONNECT_DELAY = self.CONNECT_DELAY
@@ -192,5 +507,15 @@ class SerialInstrument(object):
         self.serial.rtscts = self.rtscts
         self.serial.timeout = self.timeout
         self.serial.xonxoff = self.xonxoff
+        self.batch = BatchedQuery(self.serial, self.QUERY_SEPARATOR)
+
+    async def ask(self, query):
+        """
+        Periodic query: merged with the other queries of the same tick if
+        the instrument accepts compound queries.
+        """
+        if self.BATCH_QUERIES:
+            return await self.batch.ask(query)
+        return await self.serial.ask(query)
 
 
@@ -0,0 +1,18 @@
+"""
+Simulated instruments, to run the drivers without the hardware.
+
+Each instrument can be served over TCP like behind a Wiznet bridge
+(TcpSimulator, port 5000), or on a pseudo-terminal standing for a serial
+port (PtySimulator). The transport applies the Faults (response delay,
+jitter, dropped replies, replies split in several writes).
+
+    python -m datalogger.simulators cryocon lakeshore331 --delay 0.05
+
+serves a CryoCon on 127.0.0.1 and a LakeShore331 on 127.0.0.2 (all the
+drivers use the port 5000 of the Wiznet), e.g. for CryoCon('127.0.0.1').
+"""
+from .faults import Faults
+from .instruments import SimulatedInstrument, CryoConSimulator, \
+    LakeShore331Simulator, PressureGaugeSimulator, HeliumDepthSimulator, \
+    SIMULATORS
+from .transports import TcpSimulator, PtySimulator
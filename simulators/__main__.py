@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import ipaddress
+
+from .faults import Faults
+from .instruments import SIMULATORS
+from .transports import TcpSimulator, PtySimulator
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serves simulated instruments over TCP (one loopback '
+                    'address per instrument) or on pseudo-terminals')
+    parser.add_argument('instruments', nargs='+', choices=sorted(SIMULATORS))
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address of the first instrument')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--pty', action='store_true',
+                        help='serve on pseudo-terminals instead of TCP')
+    parser.add_argument('--delay', type=float, default=0.,
+                        help='response delay (s)')
+    parser.add_argument('--jitter', type=float, default=0.,
+                        help='random extra delay (s)')
+    parser.add_argument('--drop', type=float, default=0.,
+                        help='probability of a dropped reply')
+    parser.add_argument('--fragment', type=float, default=0.,
+                        help='probability of a reply split in pieces')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    simulators = []
+    for index, name in enumerate(args.instruments):
+        faults = Faults(delay=args.delay, jitter=args.jitter, drop=args.drop,
+                        fragment=args.fragment)
+        instrument = SIMULATORS[name]()
+        if args.pty:
+            simulator = PtySimulator(instrument, faults)
+            print('%s on %s' % (name, simulator.port))
+        else:
+            host = str(ipaddress.ip_address(args.host) + index)
+            simulator = loop.run_until_complete(
+                TcpSimulator(instrument, host, args.port, faults).start())
+            print('%s on %s:%i' % (name, host, simulator.port))
+        simulators.append(simulator)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for simulator in simulators:
+            simulator.close()
+
+
+if __name__ == '__main__':
+    main()
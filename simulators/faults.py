@@ -0,0 +1,38 @@
+import random
+
+
+class Faults(object):
+    """
+    Misbehaviour of a simulated instrument:
+        - delay: time before each reply (s)
+        - jitter: random extra delay, uniform in [0, jitter] (s)
+        - drop: probability that a reply is never sent
+        - fragment: probability that a reply is sent in several pieces,
+          fragment_gap seconds apart
+    """
+
+    def __init__(self, delay=0., jitter=0., drop=0., fragment=0.,
+                 fragment_gap=0.01, seed=None):
+        self.delay = delay
+        self.jitter = jitter
+        self.drop = drop
+        self.fragment = fragment
+        self.fragment_gap = fragment_gap
+        self.random = random.Random(seed)
+
+    def reply_delay(self):
+        return self.delay + self.random.uniform(0, self.jitter)
+
+    def dropped(self):
+        return self.random.random() < self.drop
+
+    def pieces(self, data):
+        """
+        Returns the list of the successive writes of data.
+        """
+        if len(data) < 2 or self.random.random() >= self.fragment:
+            return [data]
+        cuts = sorted(self.random.sample(range(1, len(data)),
+                                         min(len(data) - 1, 2)))
+        return [data[start:stop] for start, stop in
+                zip([0] + cuts, cuts + [len(data)])]
@@ -0,0 +1,136 @@
+"""
+Command sets of the simulated instruments.
+
+The measured values drift slowly around a base value, with some noise.
+Compound queries "Q1;Q2" are answered with "R1;R2" (see
+serial_interface.BatchedQuery).
+"""
+import math
+import random
+import re
+import time
+
+
+def split_commands(buffer):
+    """
+    Returns (complete commands, rest of the buffer). Commands are
+    terminated by any combination of '\r' and '\n'.
+    """
+    parts = re.split(b'[\r\n]', buffer)
+    return [part.decode() for part in parts[:-1] if part], parts[-1]
+
+
+class SimulatedInstrument(object):
+    """
+    handle(command) returns the reply to a command (without linebreak),
+    or None for commands without reply. Subclasses define the dict QUERIES
+    {regular expression: method name} of the queries, and WRITES likewise
+    for the commands without reply.
+    """
+    IDN = 'SIMULATOR'
+    linebreak = '\n'
+    separator = None # of compound queries (None: not supported)
+    QUERIES = dict()
+    WRITES = dict()
+    PERIOD = 600. # s, of the drift of the values
+
+    def __init__(self):
+        self.start = time.time()
+        self.random = random.Random()
+
+    def value(self, base, noise=1e-3, drift=0.05):
+        phase = 2*math.pi*(time.time() - self.start)/self.PERIOD
+        return base*(1 + drift*math.sin(phase) + self.random.gauss(0, noise))
+
+    def idn(self):
+        return self.IDN
+
+    def handle(self, command):
+        command = command.strip()
+        if self.separator and self.separator in command:
+            replies = [self.handle(part) for part in
+                       command.split(self.separator)]
+            if None in replies:
+                return None
+            return self.separator.join(replies)
+        if command == '*IDN?':
+            return self.idn()
+        for commands, reply in (self.QUERIES, True), (self.WRITES, False):
+            for pattern, method in commands.items():
+                match = re.fullmatch(pattern, command)
+                if match:
+                    result = getattr(self, method)(*match.groups())
+                    return result if reply else None
+        return None # unknown command: no reply, like the real instruments
+
+    def reply(self, command):
+        """
+        Bytes sent back for command (None if no reply).
+        """
+        reply = self.handle(command)
+        if reply is None:
+            return None
+        return (reply + self.linebreak).encode()
+
+
+class CryoConSimulator(SimulatedInstrument):
+    IDN = 'Cryo-con,24C,SIM,1.0'
+    linebreak = '\n\r'
+    separator = ';'
+    QUERIES = {r'INPUT ([A-D]):TEMPER\?': 'temperature',
+               r'CONTROL\?': 'get_control'}
+    WRITES = {r'CONTROL ON': 'control_on',
+              r'STOP': 'stop'}
+    BASE = dict(A=4.2, B=1.5, C=0.8, D=77.)
+
+    def __init__(self):
+        super(CryoConSimulator, self).__init__()
+        self.control = False
+
+    def temperature(self, channel):
+        return '%.4f' % self.value(self.BASE[channel])
+
+    def get_control(self):
+        return 'ON' if self.control else 'OFF'
+
+    def control_on(self):
+        self.control = True
+
+    def stop(self):
+        self.control = False
+
+
+class LakeShore331Simulator(SimulatedInstrument):
+    IDN = 'LSCI,MODEL331S,SIM,1.0'
+    linebreak = '\r\n'
+    separator = ';'
+    QUERIES = {r'KRDG\? ([AB])': 'temperature'}
+    BASE = dict(A=300., B=50.)
+
+    def temperature(self, channel):
+        return '%+.3f' % self.value(self.BASE[channel])
+
+
+class PressureGaugeSimulator(SimulatedInstrument):
+    IDN = 'PRESSURE GAUGE SIM'
+    linebreak = '\r'
+    QUERIES = {r'\?GA([12])': 'pressure'}
+
+    def pressure(self, gauge):
+        return '%.2E' % self.value(1e-6*int(gauge), noise=1e-2, drift=0.5)
+
+
+class HeliumDepthSimulator(SimulatedInstrument):
+    IDN = 'HELIUM LEVEL SIM'
+    linebreak = '\r\n'
+    QUERIES = {r'G': 'level'}
+    PERIOD = 86400. # slow boil-off
+
+    def level(self):
+        return 'LEVEL %04imm' % self.value(500., noise=0, drift=0.5)
+
+
+SIMULATORS = dict(cryocon=CryoConSimulator,
+                  lakeshore331=LakeShore331Simulator,
+                  pressure_gauge=PressureGaugeSimulator,
+                  helium_depth=HeliumDepthSimulator)
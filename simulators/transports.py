@@ -0,0 +1,122 @@
+import asyncio
+import os
+import threading
+import time
+
+from .faults import Faults
+from .instruments import split_commands
+
+
+class TcpSimulator(object):
+    """
+    Serves instrument on (host, port) like a Wiznet serial-to-ethernet
+    bridge. The commands are processed one at a time per connection.
+    """
+
+    def __init__(self, instrument, host='127.0.0.1', port=5000,
+                 faults=None):
+        self.instrument = instrument
+        self.host = host
+        self.port = port
+        self.faults = faults or Faults()
+        self.server = None
+        self._writers = set() # of the open connections
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host,
+                                                 self.port)
+        if not self.port: # picked by the system
+            self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        for writer in self._writers:
+            writer.close()
+
+    async def _serve(self, reader, writer):
+        buffer = b''
+        self._writers.add(writer)
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                commands, buffer = split_commands(buffer + data)
+                for command in commands:
+                    await self._reply(command, writer)
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _reply(self, command, writer):
+        reply = self.instrument.reply(command)
+        if reply is None:
+            return
+        await asyncio.sleep(self.faults.reply_delay())
+        if self.faults.dropped():
+            return
+        for index, piece in enumerate(self.faults.pieces(reply)):
+            if index:
+                await asyncio.sleep(self.faults.fragment_gap)
+            writer.write(piece)
+            await writer.drain()
+
+
+class PtySimulator(object):
+    """
+    Serves instrument on a pseudo-terminal (POSIX only): port is the device
+    to open in place of a serial port, e.g. SerialConnection(sim.port).
+    The replies are written from a background thread.
+
+    Linux pseudo-terminals refuse parity bits and 7-bit bytes: for the
+    instruments configured otherwise (LakeShore331, PressureGauge), set
+    instrument.serial.parity = 'N' and instrument.serial.bytesize = 8.
+    """
+
+    def __init__(self, instrument, faults=None):
+        import tty
+        self.instrument = instrument
+        self.faults = faults or Faults()
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave) # no echo nor line editing
+        self.port = os.ttyname(self.slave)
+        self._closed = False
+        self.thread = threading.Thread(target=self._serve, daemon=True,
+                                       name='pty ' + self.port)
+        self.thread.start()
+
+    def close(self):
+        self._closed = True
+        for fd in self.master, self.slave:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _serve(self):
+        buffer = b''
+        while not self._closed:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError: # closed
+                break
+            commands, buffer = split_commands(buffer + data)
+            for command in commands:
+                self._reply(command)
+
+    def _reply(self, command):
+        reply = self.instrument.reply(command)
+        if reply is None:
+            return
+        time.sleep(self.faults.reply_delay())
+        if self.faults.dropped():
+            return
+        for index, piece in enumerate(self.faults.pieces(reply)):
+            if index:
+                time.sleep(self.faults.fragment_gap)
+            os.write(self.master, piece)
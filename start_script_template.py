@@ -8,7 +8,9 @@ To try them out, set the "callback" field of a channel to either "random_func"
 or "random_coroutine"
 
 The script can be re-run to take into account the lattest modifications by
-right-clicking in the channel tree view.
+right-clicking in the channel tree view. The instruments (SerialInstrument
+subclasses) are not re-created: the same object is returned for the same
+address, with its open connection.
 """
 
 ## option 1. use a standard function returning a float
@@ -22,4 +24,8 @@ async def random_coroutine():
     import asyncio
     import numpy as np
     await asyncio.sleep(0.1)
-    return np.random.rand()
\ No newline at end of file
+    return np.random.rand()
+
+## Plain functions are run in a thread pool, so that a blocking driver only
+## delays its own channel. See datalogger/offload.py to run them in a process
+## pool (@cpu_bound) or directly in the event loop (@inline) instead.
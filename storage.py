@@ -0,0 +1,244 @@
+"""
+Storage of the channel data.
+
+A channel file <name>.chan is a flat sequence of 16-byte records
+(time, value), both native doubles, appended in chronological order.
+"""
+import os
+import os.path as osp
+import time
+import asyncio
+import numpy as np
+
+from . import telemetry
+
+RECORD_DTYPE = np.dtype([('time', float), ('value', float)])
+
+
+def empty_records():
+    return np.empty(0, dtype=RECORD_DTYPE)
+
+
+class ChannelFile(object):
+    """
+    Read access to a .chan file through a memory map.
+
+    Since the time column is monotonic, the records of a time interval are
+    located by binary search and returned as views into the map: nothing
+    outside of the requested interval is read from disk.
+    """
+
+    def __init__(self, filename, dtype=RECORD_DTYPE):
+        self.filename = filename
+        self.dtype = dtype
+        self._records = np.empty(0, dtype=dtype)
+        self._handle = None
+
+    @property
+    def path(self):
+        return self.filename
+
+    def exists(self):
+        return osp.exists(self.filename)
+
+    def create(self):
+        """
+        Creates an empty data file.
+        """
+        with open(self.filename, 'ab'):
+            pass
+
+    @property
+    def n_records(self):
+        if not osp.exists(self.filename):
+            return 0
+        return osp.getsize(self.filename) // self.dtype.itemsize
+
+    @property
+    def records(self):
+        """
+        Memory-mapped records of the file. The map is only re-created when
+        the file has grown since the last call.
+        """
+        n_records = self.n_records
+        if n_records != len(self._records):
+            if n_records == 0: # mmap refuses empty files
+                self._records = np.empty(0, dtype=self.dtype)
+            else:
+                self._records = np.memmap(self.filename, dtype=self.dtype,
+                                          mode='r', shape=(n_records,))
+        return self._records
+
+    def last_time(self):
+        """
+        Time of the last record (None if the file is empty).
+        """
+        records = self.records
+        return float(records['time'][-1]) if len(records) else None
+
+    def append(self, records):
+        """
+        Appends an array of self.dtype at the end of the file. The file
+        handle is kept open between calls.
+        """
+        if self._handle is None:
+            self._handle = open(self.filename, 'ab')
+        self._handle.write(records.tobytes())
+        self._handle.flush()
+
+    def sync(self):
+        """
+        Forces the appended data down to the disk.
+        """
+        if self._handle is not None:
+            os.fsync(self._handle.fileno())
+
+    def close(self):
+        """
+        Releases the memory map and the file handle (both prevent renaming
+        the file on Windows).
+        """
+        self._records = np.empty(0, dtype=self.dtype)
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def slice(self, t0=None, t1=None):
+        """
+        Returns the records with t0 <= time <= t1 (None means unbounded).
+        """
+        records = self.records
+        times = records['time']
+        start = 0 if t0 is None else np.searchsorted(times, t0, side='left')
+        stop = len(records) if t1 is None else np.searchsorted(times, t1,
+                                                               side='right')
+        return records[start:stop]
+
+    def read(self, t0=None, t1=None):
+        """
+        Returns (times, values) of the records with t0 <= time <= t1 as
+        zero-copy views.
+        """
+        records = self.slice(t0, t1)
+        return records['time'], records['value']
+
+    def iter_chunks(self, t0=None, chunk_size=2**20):
+        """
+        Yields the records with time >= t0 in arrays of at most chunk_size
+        records.
+        """
+        records = self.slice(t0)
+        for start in range(0, len(records), chunk_size):
+            yield records[start:start + chunk_size]
+
+
+FSYNC_NEVER = 'never'
+FSYNC_BATCH = 'batch'
+
+
+class WriterService(object):
+    """
+    Group-commit writer shared by all the channels of a directory.
+
+    Points are accumulated per storage in a preallocated array of
+    storage.dtype (one field per extra argument of append) and
+    appended to disk in one write when batch_size points are pending or
+    flush_interval seconds after the first pending point.
+
+    fsync is the durability policy:
+     - FSYNC_NEVER: leaves the data in the OS cache,
+     - FSYNC_BATCH: fsyncs after each batch,
+     - a number N: fsyncs the written files at most every N seconds.
+    """
+    BATCH_SIZE = 256
+    FLUSH_INTERVAL = 1.
+
+    def __init__(self, batch_size=None, flush_interval=None,
+                 fsync=FSYNC_NEVER):
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.flush_interval = self.FLUSH_INTERVAL if flush_interval is None \
+            else flush_interval
+        self.fsync = fsync
+        self._buffers = dict() # storage -> [records, n_pending]
+        self._unsynced = set()
+        self._last_sync = time.monotonic()
+        self._timer = None
+        self.closed = False
+
+    def append(self, storage, *fields):
+        if self.closed: # the point would be lost
+            raise ValueError('Point appended to %s after the writer service '
+                             'was closed' % storage.path)
+        buf = self._buffers.get(storage)
+        if buf is None:
+            buf = self._buffers[storage] = [np.empty(self.batch_size,
+                                                     dtype=storage.dtype), 0]
+        records, n_pending = buf
+        records[n_pending] = fields
+        buf[1] = n_pending + 1
+        if buf[1] >= self.batch_size:
+            self.flush(storage)
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(
+                self.flush_interval, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self.flush()
+
+    def flush(self, storage=None):
+        """
+        Writes the pending points of storage (of all storages if None).
+        """
+        storages = list(self._buffers) if storage is None else [storage]
+        start = time.perf_counter()
+        written = False
+        for st in storages:
+            buf = self._buffers.get(st)
+            if buf is None or buf[1] == 0:
+                continue
+            st.append(buf[0][:buf[1]])
+            buf[1] = 0
+            self._unsynced.add(st)
+            written = True
+        if written: # no-op flushes would skew the histogram
+            telemetry.record('write', 'flush', time.perf_counter() - start)
+        self._sync()
+
+    def _sync(self, force=False):
+        if self.fsync == FSYNC_NEVER and not force or not self._unsynced:
+            return
+        now = time.monotonic()
+        if not force and self.fsync != FSYNC_BATCH and \
+                now - self._last_sync < self.fsync:
+            return
+        with telemetry.timed('write', 'fsync'):
+            for st in self._unsynced:
+                st.sync()
+        self._unsynced.clear()
+        self._last_sync = now
+
+    def release(self, storage):
+        """
+        Flushes the pending points of storage and closes it.
+        """
+        self.flush(storage)
+        self._buffers.pop(storage, None)
+        self._unsynced.discard(storage)
+        storage.close()
+
+    def close(self):
+        """
+        Flushes and syncs everything: to be called at shutdown so that no
+        point is lost.
+        """
+        self.closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.flush()
+        if self.fsync != FSYNC_NEVER:
+            self._sync(force=True)
+        for st in list(self._buffers):
+            st.close()
+        self._buffers.clear()
@@ -0,0 +1,150 @@
+"""
+Acquisition telemetry: histograms of the durations of the hot paths,
+grouped by category and name, e.g.:
+    - ('callback', channel name): duration of the measurements
+    - ('transaction', port): serial/Wiznet transactions (queue included)
+    - ('write', 'flush'/'fsync'): writer service
+    - ('redraw', 'live'/'view'): repaints of the curves
+    - ('loop', 'lag'): lateness of the event loop (see LoopLagMonitor)
+The histograms are process-wide, like the ports they describe.
+"""
+import asyncio
+import json
+import math
+import time
+from contextlib import contextmanager
+
+_histograms = dict() # (category, name) -> Histogram
+
+
+class Histogram(object):
+    """
+    Durations in logarithmic bins (BINS_PER_DECADE per decade from MIN to
+    MAX seconds). The quantiles are exact to the width of a bin.
+    """
+    MIN = 1e-6
+    MAX = 1e3
+    BINS_PER_DECADE = 10
+
+    def __init__(self):
+        n_bins = int(round(math.log10(self.MAX/self.MIN)*
+                           self.BINS_PER_DECADE))
+        self.counts = [0]*(n_bins + 1) # the last bin is above MAX
+        self.n = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value):
+        if value <= self.MIN:
+            index = 0
+        else:
+            index = min(int(math.log10(value/self.MIN)*self.BINS_PER_DECADE),
+                        len(self.counts) - 1)
+        self.counts[index] += 1
+        self.n += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def upper_edge(self, index):
+        return self.MIN*10**((index + 1)/self.BINS_PER_DECADE)
+
+    def quantile(self, q):
+        if not self.n:
+            return None
+        target = q*self.n
+        cumulated = 0
+        for index, count in enumerate(self.counts):
+            cumulated += count
+            if cumulated >= target:
+                return min(self.upper_edge(index), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total/self.n if self.n else None
+
+    def as_dict(self):
+        return dict(n=self.n, mean=self.mean, p50=self.quantile(0.5),
+                    p95=self.quantile(0.95), p99=self.quantile(0.99),
+                    max=self.max)
+
+
+def record(category, name, duration):
+    key = (category, name)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = Histogram()
+    histogram.add(duration)
+
+
+@contextmanager
+def timed(category, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(category, name, time.perf_counter() - start)
+
+
+def histograms():
+    """
+    Returns {category: {name: statistics}}.
+    """
+    report = dict()
+    for (category, name), histogram in sorted(_histograms.items()):
+        report.setdefault(category, dict())[name] = histogram.as_dict()
+    return report
+
+
+def reset():
+    _histograms.clear()
+
+
+def format_histograms():
+    """
+    Text table of the histograms (durations in ms).
+    """
+    lines = ['%-12s %-24s %8s %9s %9s %9s %9s' % (
+        'category', 'name', 'n', 'p50', 'p95', 'p99', 'max')]
+    for category, names in histograms().items():
+        for name, stats in names.items():
+            lines.append('%-12s %-24s %8i %9.3f %9.3f %9.3f %9.3f' % (
+                category, name, stats['n'], 1e3*stats['p50'],
+                1e3*stats['p95'], 1e3*stats['p99'], 1e3*stats['max']))
+    return '\n'.join(lines)
+
+
+def dump(filename, report):
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+
+
+class LoopLagMonitor(object):
+    """
+    Measures the lateness of a callback scheduled every interval seconds:
+    the time the event loop (quamash or asyncio) was kept busy by others.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self._handle = None
+        self._expected = None
+
+    def start(self):
+        if self._handle is None:
+            self._schedule()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self):
+        self._expected = time.monotonic() + self.interval
+        self._handle = asyncio.get_event_loop().call_later(self.interval,
+                                                           self._tick)
+
+    def _tick(self):
+        record('loop', 'lag', max(0., time.monotonic() - self._expected))
+        self._schedule()
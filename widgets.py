@@ -1,19 +1,37 @@
 from qtpy import QtWidgets, QtCore, QtGui
 import pyqtgraph as pg
 import asyncio
-import time
-import numpy as np
+import sys
+import quamash
+
+from .lod import ViewportLoader
+from .ringbuffer import RingBuffer
+from . import telemetry
+
+
+def setup_event_loop():
+    """
+    Creates the QApplication if needed, and makes a quamash loop (asyncio
+    loop running in the Qt event loop) the current event loop.
+    """
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication(sys.argv)
+    if not isinstance(asyncio.get_event_loop(), quamash.QEventLoop):
+        asyncio.set_event_loop(quamash.QEventLoop(app))
+    return app
 
 
 class MyTreeWidgetItem(QtWidgets.QTreeWidgetItem):
     COLORS = ['red', 'green', 'blue', 'cyan', 'magenta']
     N_CHANNELS = 0
+    MAX_POINTS_PER_PIXEL = 4 # above, the live curve is decimated to the plot
+    # resolution, so that long windows at high rates stay cheap to draw
 
 
     def __init__(self, parent, channel):
         super(MyTreeWidgetItem, self).__init__(parent)
-        self.times = []
-        self.values = []
+        self.buffer = RingBuffer()
         self.channel = channel
         color = self.COLORS[self.N_CHANNELS % len(self.COLORS)]
         MyTreeWidgetItem.N_CHANNELS+=1
@@ -30,46 +48,124 @@ class MyTreeWidgetItem(QtWidgets.QTreeWidgetItem):
         self.curve = self.dlg.widget.plot_item.plot(pen=color[0])
         self.curve.setVisible(channel.visible)
 
-    def plot_point(self, val, moment):
-        self.values.append(val)
-        self.times.append(moment)
+    @property
+    def times(self):
+        return self.buffer.times
 
-        for index, moment in enumerate(self.times):
-            if moment<self.dlg.earliest_point:
-                self.values.pop(index)
-                self.times.pop(index)
-            else:
-                break
-        self.curve.setData(self.times, self.values)
+    @property
+    def values(self):
+        return self.buffer.values
 
-    def plot_points(self, vals, times):
-        self.values = [val for val in vals]
-        self.times = [time for time in times]
+    def plot_point(self, val, moment):
+        """
+        Adds a point to the live curve; the curve is repainted by the
+        refresh scheduler of the main widget.
+        """
+        self.buffer.append(moment, val)
+        self.dlg.widget.refresher.mark_dirty(self)
+
+    def refresh(self):
+        self.buffer.evict_before(self.dlg.earliest_point)
+        plot_width = self.dlg.widget.plot_width
+        if len(self.buffer) > self.MAX_POINTS_PER_PIXEL*plot_width:
+            self.buffer.decimate((self.dlg.latest_point -
+                                  self.dlg.earliest_point)/plot_width)
+        if not self.dlg.widget.viewport.active:
+            self.curve.setData(self.times, self.values)
 
+    def plot_points(self, vals, times):
+        self.buffer.set(times, vals)
+        if not self.dlg.widget.viewport.active: # else, shown by redraw
+            self.curve.setData(self.times, self.values)
+
+    def set_visible(self, val):
+        self.curve.setVisible(val)
+
+    def show_view(self, times, values):
+        """
+        Displays data fetched for the current view range.
+        """
+        self.curve.setData(times, values)
+
+    def redraw(self):
+        """
+        Displays the live data again.
+        """
         self.curve.setData(self.times, self.values)
 
+    ERROR_COLORS = {'closed': 'green', 'half_open': 'orange', 'open': 'red'}
+
     def show_error_state(self):
-        color = 'red' if self.channel.error_state else 'green'
+        """
+        Red: invalid callback or device failing (circuit breaker open),
+        orange: probing the device again, green: ok.
+        """
+        if self.channel.error_state:
+            color, tooltip = 'red', 'invalid callback'
+        else:
+            color = self.ERROR_COLORS[self.channel.breaker.state]
+            tooltip = str(self.channel.breaker)
+        tree = self.treeWidget()
+        blocked = tree is not None and tree.blockSignals(True)
         self.setBackground(4, QtGui.QColor(color))
+        self.setToolTip(4, tooltip)
+        if tree is not None:
+            tree.blockSignals(blocked)
 
 class MyTreeWidget(QtWidgets.QTreeWidget):
     def __init__(self, datalogger):
         super(MyTreeWidget, self).__init__()
         self.setHeaderLabels(["Channel", "Visible", "Active",
-                              "Delay", "Callback"])
-        self.setColumnCount(5)
+                              "Delay", "Callback", "Timeout"])
+        self.setColumnCount(6)
         self.dlg = datalogger
         self.itemChanged.connect(self.update)
         self.setSortingEnabled(True)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+
+    @property
+    def items(self):
+        return [self.topLevelItem(index)
+                for index in range(self.topLevelItemCount())]
+
+    def update(self, item, column):
+        """
+        Applies the edited cell to its channel only.
+        """
+        channel = item.channel
+        try:
+            if column == 0:
+                channel.name = str(item.text(0))
+            elif column == 1:
+                channel.visible = item.checkState(1) == 2
+            elif column == 2:
+                channel.active = item.checkState(2) == 2
+            elif column == 3:
+                channel.delay = float(item.text(3))
+            elif column == 4:
+                if str(item.text(4)) != channel.callback:
+                    channel.callback = str(item.text(4))
+            elif column == 5:
+                channel.timeout = float(item.text(5))
+        except ValueError as e: # invalid name, delay...: restore the cell
+            print(channel.name, ':', e)
+            self.blockSignals(True)
+            item.setText(0, channel.name)
+            item.setText(3, str(channel.delay))
+            item.setText(5, str(channel.timeout))
+            self.blockSignals(False)
+        self.blockSignals(True)
+        item.show_error_state()
+        self.blockSignals(False)
 
-    def update(self):
-        for channel in self.dlg.channels.values():
-            channel.name = str(channel.widget.text(0))
-            channel.visible = channel.widget.checkState(1) == 2
-            channel.active = channel.widget.checkState(2) == 2
-            channel.delay = float(channel.widget.text(3))
-            channel.callback = str(channel.widget.text(4))
-            channel.widget.show_error_state()
+    def set_selected(self, column, checked):
+        """
+        Checks/unchecks column for all selected channels, with a single write
+        of the config file.
+        """
+        with self.dlg.config.batch():
+            for item in self.selectedItems():
+                item.setCheckState(column, checked * 2)
 
     def create_channel(self, channel):
         self.blockSignals(True)
@@ -90,6 +186,19 @@ class MyTreeWidget(QtWidgets.QTreeWidget):
         action_rerun.setText('run start_script again')
         action_rerun.triggered.connect(self.dlg.run_start_script)
         menu.addAction(action_rerun)
+
+        if len(self.selectedItems()) > 1:
+            menu.addSeparator()
+            for text, column, checked in [('activate selected', 2, True),
+                                          ('deactivate selected', 2, False),
+                                          ('show selected', 1, True),
+                                          ('hide selected', 1, False)]:
+                action = QtWidgets.QAction(menu)
+                action.setText(text)
+                action.triggered.connect(
+                    lambda _=False, column=column, checked=checked:
+                    self.set_selected(column, checked))
+                menu.addAction(action)
         menu.exec(evt.globalPos())
 
     """
@@ -136,6 +245,83 @@ class MyDockTreeWidget(QtWidgets.QDockWidget):
         self.setWidget(self.mycontrolwidget)
 
 
+class DiagnosticsDock(QtWidgets.QDockWidget):
+    """
+    Telemetry of the acquisition (see telemetry.py), refreshed every second
+    while the dock is visible.
+    """
+    INTERVAL_MS = 1000
+
+    def __init__(self, datalogger):
+        super(DiagnosticsDock, self).__init__("Diagnostics")
+        self.dlg = datalogger
+        self.widget = QtWidgets.QWidget()
+        self.lay_v = QtWidgets.QVBoxLayout()
+        self.widget.setLayout(self.lay_v)
+        self.text = QtWidgets.QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.text.setFont(QtGui.QFontDatabase.systemFont(
+            QtGui.QFontDatabase.FixedFont))
+        self.lay_v.addWidget(self.text)
+        self.lay_h = QtWidgets.QHBoxLayout()
+        self.lay_v.addLayout(self.lay_h)
+        self.lay_h.addStretch()
+        self.button_reset = QtWidgets.QPushButton("Reset")
+        self.button_reset.clicked.connect(self.reset)
+        self.lay_h.addWidget(self.button_reset)
+        self.button_dump = QtWidgets.QPushButton("Dump...")
+        self.button_dump.clicked.connect(self.dump)
+        self.lay_h.addWidget(self.button_dump)
+        self.setWidget(self.widget)
+
+        self.timer = QtCore.QTimer()
+        self.timer.setInterval(self.INTERVAL_MS)
+        self.timer.timeout.connect(self.update_text)
+        self.visibilityChanged.connect(self.update_timer)
+
+    def update_timer(self, visible):
+        if visible:
+            self.update_text()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def update_text(self):
+        report = self.dlg.telemetry_report()
+        lines = [telemetry.format_histograms(), '',
+                 '%-24s %8s %9s %9s %9s  %s' % ('channel', 'delay', 'period',
+                                                'late avg', 'late max',
+                                                'breaker')]
+        for name, stats in sorted(report['sampling'].items()):
+            lines.append('%-24s %8.3f %9s %9s %9s  %s' % (
+                name, float(stats['delay']),
+                '%.3f' % stats['period'] if stats['period'] else '-',
+                '%.1fms' % (1e3*stats['lateness_mean'])
+                if stats['lateness_mean'] is not None else '-',
+                '%.1fms' % (1e3*stats['lateness_max'])
+                if stats['lateness_max'] is not None else '-',
+                stats['breaker']))
+        lines += ['', '%-24s %8s %8s %9s %9s  %s' % (
+            'queue', 'depth', 'done', 'wait avg', 'wait max', 'breaker')]
+        for name, stats in sorted(report['queues'].items()):
+            lines.append('%-24s %8i %8i %7.1fms %7.1fms  %s' % (
+                name, stats['depth'], stats['n_done'],
+                1e3*stats['mean_wait'], 1e3*stats['max_wait'],
+                stats['breaker']))
+        self.text.setPlainText('\n'.join(lines))
+
+    def reset(self):
+        telemetry.reset()
+        self.update_text()
+
+    def dump(self):
+        filename, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Dump telemetry", "telemetry.json", "JSON (*.json)")
+        if filename:
+            self.dlg.dump_telemetry(filename)
+
+
 class TimeAxisItem(pg.AxisItem):
     def __init__(self, *args, **kwargs):
         super(TimeAxisItem, self).__init__(*args, **kwargs)
@@ -162,6 +348,8 @@ class DataloggerMenu(QtWidgets.QMenuBar):
         self.action_new.triggered.connect(self.new_file)
         self.menufile.addAction(self.action_new)
         self.menufile.addAction(self.action_load)
+        self.menuview = QtWidgets.QMenu("View")
+        self.addMenu(self.menuview)
         '''
         #modif Edouard
         self.action_load_1_more_day = QtWidgets.QAction("Load 1 more day of data...", self)
@@ -178,7 +366,46 @@ class DataloggerMenu(QtWidgets.QMenuBar):
         self.datalogger.load()
 
 
+class RefreshScheduler(object):
+    """
+    Coalesces the repaints of the curves: items receiving points are marked
+    dirty, and all dirty items are refreshed together at most fps times per
+    second, whatever the number of channels and their rates.
+    """
+
+    def __init__(self, fps=20):
+        self._dirty = set()
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.refresh)
+        self.fps = fps
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @fps.setter
+    def fps(self, val):
+        self._fps = val
+        self.timer.setInterval(int(1000./val))
+
+    def mark_dirty(self, item):
+        self._dirty.add(item)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def refresh(self):
+        dirty, self._dirty = self._dirty, set()
+        with telemetry.timed('redraw', 'live'):
+            for item in dirty:
+                item.refresh()
+
+
 class DataLoggerWidget(QtWidgets.QMainWindow):
+    DEFAULT_PLOT_WIDTH = 1000 # used as long as the window is not laid out
+    VIEW_DEBOUNCE_MS = 100
+    REFRESH_FPS = 20 # can be overridden by "refresh_fps" in the config file
+
     def __init__(self, datalogger):
         super(DataLoggerWidget, self).__init__()
         self.current_channel_index = -1
@@ -189,13 +416,58 @@ class DataLoggerWidget(QtWidgets.QMainWindow):
         self.plot_item.showGrid(y=True, alpha=1.)
         self.setCentralWidget(self.graph)
 
+        self.refresher = RefreshScheduler(
+            datalogger.get_config_from_file().get("refresh_fps",
+                                                  self.REFRESH_FPS))
+
+        self.viewport = ViewportLoader(self)
+        self._showing_view = False
+        self._view_timer = QtCore.QTimer() # waits for the end of a zoom/pan
+        self._view_timer.setSingleShot(True)
+        self._view_timer.setInterval(self.VIEW_DEBOUNCE_MS)
+        self._view_timer.timeout.connect(self.update_view)
+        self.plot_item.sigXRangeChanged.connect(
+            lambda *args: self._view_timer.start())
+
         self._dock_tree = MyDockTreeWidget(datalogger)
         self.tree = self._dock_tree.tree
         self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self._dock_tree)
         self.menubar = DataloggerMenu(datalogger)
         self.setMenuBar(self.menubar)
+        self.diagnostics = DiagnosticsDock(datalogger)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.diagnostics)
+        self.diagnostics.hide()
+        self.menubar.menuview.addAction(self.diagnostics.toggleViewAction())
         self.show()
 
     def create_channel(self, channel):
         return self.tree.create_channel(channel)
 
+    def show_loading_progress(self, n_loaded, n_loading):
+        if n_loading:
+            self.statusBar().showMessage('loading history: %i/%i channels' % (
+                n_loaded, n_loading))
+        else:
+            self.statusBar().clearMessage()
+
+    def update_view(self):
+        """
+        Fetches the data of the view range when the user zooms/pans, goes
+        back to the live data when auto-range is restored.
+        """
+        if self.viewport.active:
+            self._showing_view = True
+            self.viewport.refresh()
+        elif self._showing_view:
+            self._showing_view = False
+            for item in self.tree.items:
+                item.redraw()
+
+    @property
+    def plot_width(self):
+        """
+        Width of the plot area in pixels.
+        """
+        width = self.plot_item.vb.width()
+        return width if width > 1 else self.DEFAULT_PLOT_WIDTH
+